@@ -28,6 +28,10 @@ class DiffRequestRecord(BaseModel):
     repo_name: Optional[str] = None
     user_id: Optional[str] = None  # For future user tracking
     
+    # Result cache key: the commit the diff was generated against, and a hash of it with the inputs
+    head_sha: Optional[str] = None
+    prompt_hash: Optional[str] = None
+    
     # Processing results
     initial_diff: Optional[str] = None
     final_diff: Optional[str] = None
@@ -59,6 +63,8 @@ class DiffRequestCreate(BaseModel):
 class DiffRequestUpdate(BaseModel):
     """Model for updating existing diff requests."""
     status: Optional[RequestStatus] = None
+    head_sha: Optional[str] = None
+    prompt_hash: Optional[str] = None
     initial_diff: Optional[str] = None
     final_diff: Optional[str] = None
     reflection_applied: Optional[bool] = None
@@ -2,30 +2,48 @@
 Utility to parse and apply unified diffs to files.
 """
 
-import re
+import io
 import logging
 from typing import Dict, List, Tuple, Optional
 
 logger = logging.getLogger(__name__)
 
+def _header_path(path: str) -> str:
+    """Drop the optional tab-separated timestamp that diff tools append to header paths."""
+    return path.partition('\t')[0]
+
 class DiffApplier:
     def __init__(self):
         pass
     
+    def _split_file_sections(self, diff_content: str) -> List[List[str]]:
+        """Split a diff into per-file line lists, starting a new section at each '--- ' header."""
+        sections = []
+        current: List[str] = []
+        
+        for line in diff_content.split('\n'):
+            if line.startswith('--- ') and current:
+                sections.append(current)
+                current = []
+            current.append(line)
+        
+        if current:
+            sections.append(current)
+        
+        return sections
+    
     def parse_unified_diff(self, diff_content: str) -> Dict[str, str]:
         """Parse unified diff and return a dictionary of file changes."""
         changes = {}
         
-        # Split diff into individual file changes
-        file_sections = re.split(r'^--- ', diff_content, flags=re.MULTILINE)
+        # Nothing to parse without a file header; skip the split entirely
+        if '--- ' not in diff_content:
+            return changes
         
-        for section in file_sections:
-            if not section.strip():
+        # Split diff into individual file changes
+        for section in self._split_file_sections(diff_content):
+            if not any(line.strip() for line in section):
                 continue
-                
-            # Add back the --- that was removed by split
-            if not section.startswith('---'):
-                section = '--- ' + section
             
             file_change = self._parse_file_diff(section)
             if file_change:
@@ -34,22 +52,26 @@ class DiffApplier:
         
         return changes
     
-    def _parse_file_diff(self, diff_section: str) -> Optional[Tuple[str, str]]:
+    def _parse_file_diff(self, lines: List[str]) -> Optional[Tuple[str, str]]:
         """Parse a single file's diff section."""
-        lines = diff_section.split('\n')
-        
-        # Find file path from headers
+        # Find file path and the start of the hunks (after the +++ line) in one pass
         file_path = None
-        for line in lines:
-            if line.startswith('--- a/'):
-                file_path = line[6:]  # Remove '--- a/'
+        hunk_start = None
+        for i, line in enumerate(lines):
+            if file_path is None:
+                if line.startswith('--- a/'):
+                    file_path = _header_path(line[6:])  # Remove '--- a/'
+                elif line.startswith('--- '):
+                    # Handle cases without a/ prefix
+                    path = _header_path(line[4:])
+                    if path != '/dev/null':
+                        file_path = path
+            
+            if hunk_start is None and line.startswith('+++'):
+                hunk_start = i + 1
+            
+            if file_path is not None and hunk_start is not None:
                 break
-            elif line.startswith('--- '):
-                # Handle cases without a/ prefix
-                path = line[4:]
-                if path != '/dev/null':
-                    file_path = path
-                    break
         
         if not file_path:
             logger.warning("Could not extract file path from diff section")
@@ -57,51 +79,40 @@ class DiffApplier:
         
         # Apply the diff changes
         try:
-            new_content = self._apply_hunks(lines)
+            new_content = self._apply_hunks(lines, hunk_start or 0)
             return file_path, new_content
         except Exception as e:
             logger.error(f"Failed to apply diff for {file_path}: {e}")
             return None
     
-    def _apply_hunks(self, diff_lines: List[str]) -> str:
-        """Apply diff hunks to reconstruct the file content."""
-        result_lines = []
-        
-        # Find the start of hunks (after the +++ line)
-        hunk_start = 0
-        for i, line in enumerate(diff_lines):
-            if line.startswith('+++'):
-                hunk_start = i + 1
-                break
+    def _apply_hunks(self, diff_lines: List[str], hunk_start: int = 0) -> str:
+        """Apply diff hunks, starting at index hunk_start, to reconstruct the file content."""
+        result = io.StringIO()
+        write = result.write
         
         # Process each hunk
-        i = hunk_start
-        while i < len(diff_lines):
-            line = diff_lines[i]
+        for line in diff_lines[hunk_start:]:
+            # Dispatch on the first character's code point rather than chained startswith calls
+            c = ord(line[0]) if line else 0
             
-            if line.startswith('@@'):
-                # This is a hunk header, skip it
-                i += 1
-                continue
-            elif line.startswith('-'):
+            # Ordered by how often each kind of line shows up in generated diffs
+            if c == 32 or c == 43:  # ' ' or '+'
+                # Context line (unchanged) or added line
+                write(line[1:])  # Remove the ' ' / '+' prefix
+                write('\n')
+            elif c == 45:  # '-'
                 # Skip removed lines
-                i += 1
                 continue
-            elif line.startswith('+'):
-                # Add new lines
-                result_lines.append(line[1:])  # Remove the '+' prefix
-                i += 1
-            elif line.startswith(' '):
-                # Context line (unchanged)
-                result_lines.append(line[1:])  # Remove the ' ' prefix
-                i += 1
-            else:
+            elif c == 64 and line.startswith('@@'):  # '@'
+                # This is a hunk header, skip it
+                continue
+            elif line.strip():
                 # Regular line or end of section
-                if line.strip():
-                    result_lines.append(line)
-                i += 1
+                write(line)
+                write('\n')
         
-        return '\n'.join(result_lines)
+        # Drop the separator written after the last line
+        return result.getvalue()[:-1]
     
     def apply_diff_to_content(self, original_content: str, diff_content: str) -> str:
         """Apply a unified diff to existing content."""
@@ -114,7 +125,7 @@ class DiffApplier:
         # For simplicity, if we have changes, use the first one
         # In a real implementation, you'd need to match the file path
         if changes:
-            return list(changes.values())[0]
+            return next(iter(changes.values()))
         
         return original_content
     
@@ -123,11 +134,13 @@ class DiffApplier:
         # This is a more robust approach that reconstructs files from diffs
         changes = {}
         
-        # Split by file boundaries
-        file_sections = re.split(r'^(?=--- )', diff_content, flags=re.MULTILINE)
+        # Nothing to extract without a file header; skip the split entirely
+        if '--- ' not in diff_content:
+            return changes
         
-        for section in file_sections:
-            if not section.strip():
+        # Split by file boundaries
+        for section in self._split_file_sections(diff_content):
+            if not any(line.strip() for line in section):
                 continue
             
             # Extract file path
@@ -136,7 +149,7 @@ class DiffApplier:
                 continue
             
             # Check if this is a new file or modification
-            if '--- /dev/null' in section:
+            if section[0].startswith('--- /dev/null'):
                 # New file
                 new_content = self._extract_new_file_content(section)
                 changes[file_path] = new_content
@@ -149,21 +162,19 @@ class DiffApplier:
         
         return changes
     
-    def _extract_file_path(self, section: str) -> Optional[str]:
+    def _extract_file_path(self, lines: List[str]) -> Optional[str]:
         """Extract file path from diff section."""
-        lines = section.split('\n')
         for line in lines:
             if line.startswith('+++ b/'):
-                return line[6:]  # Remove '+++ b/'
+                return _header_path(line[6:])  # Remove '+++ b/'
             elif line.startswith('+++ '):
-                path = line[4:]
+                path = _header_path(line[4:])
                 if path != '/dev/null':
                     return path
         return None
     
-    def _extract_new_file_content(self, section: str) -> str:
+    def _extract_new_file_content(self, lines: List[str]) -> str:
         """Extract content for a new file."""
-        lines = section.split('\n')
         content_lines = []
         
         in_content = False
@@ -176,21 +187,17 @@ class DiffApplier:
         
         return '\n'.join(content_lines)
     
-    def _extract_modified_content(self, section: str) -> Optional[str]:
+    def _extract_modified_content(self, lines: List[str]) -> Optional[str]:
         """Extract modified content from diff section."""
-        lines = section.split('\n')
         content_lines = []
+        append = content_lines.append
         
         in_content = False
         for line in lines:
             if line.startswith('@@'):
                 in_content = True
-                continue
-            elif in_content:
-                if line.startswith('+'):
-                    content_lines.append(line[1:])  # Add new lines
-                elif line.startswith(' '):
-                    content_lines.append(line[1:])  # Add context lines
-                # Skip lines starting with '-' (removed lines)
+            elif in_content and line.startswith(('+', ' ')):
+                # Add new and context lines, skipping removed lines
+                append(line[1:])
         
         return '\n'.join(content_lines) if content_lines else None
\ No newline at end of file
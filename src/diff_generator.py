@@ -3,25 +3,91 @@ Core diff generation service that orchestrates the entire workflow.
 """
 
 import os
-import tempfile
-import shutil
+import asyncio
+import hashlib
 import logging
 import time
 import uuid
+from concurrent.futures import Executor
+from contextlib import AsyncExitStack, aclosing
 from datetime import datetime
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+from fastapi import HTTPException
 from models import DiffRequest, DiffResponse
-from repo_service import clone_repository, get_repo_structure, read_file_contents
-from llm_service import generate_initial_diff, reflect_on_diff
-from github_service import GitHubService
+from repo_service import (
+    RepoMirrorCache, get_file_modes, get_repo_structure, prefetch_blobs, read_file_contents
+)
+from llm_service import generate_initial_diff, reflect_on_diff, stream_initial_diff
+from github_service import ACCESS_ERROR_CODES, GitHubService, MAX_CONCURRENT_WRITES
 from diff_applier import DiffApplier
 from supabase_service import SupabaseService
 from database_models import DiffRequestCreate, DiffRequestUpdate, RequestStatus
 
 logger = logging.getLogger(__name__)
 
-async def generate_diff(request: DiffRequest) -> DiffResponse:
+# Long-lived mirrors of requested repositories, reused across requests. The default is in the
+# user's own cache directory; a shared one like /tmp would let other users tamper with them.
+MIRROR_DIR = os.environ.get("TINYGEN_MIRROR_DIR") or os.path.join(
+    os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache"),
+    "tinygen", "mirrors"
+)
+
+# Total size the mirrors may take before the least recently used ones are removed
+MIRROR_CACHE_MAX_BYTES = int(os.environ.get("TINYGEN_MIRROR_CACHE_BYTES", 2 * 1024 * 1024 * 1024))
+
+repo_mirrors = RepoMirrorCache(MIRROR_DIR, MIRROR_CACHE_MAX_BYTES)
+
+# Longest diff embedded in a pull request description; GitHub caps the body at 65536 characters
+MAX_PR_BODY_DIFF_CHARS = 50_000
+
+async def _await_logged(awaitable: Awaitable, description: str) -> None:
+    """Wait for a background operation, logging its failure instead of raising it."""
+    try:
+        await awaitable
+    except Exception as e:
+        logger.error(f"Failed to {description}: {e}")
+
+class _BackgroundWrites:
+    """Database writes that run in the background, one at a time in submission order.
+    
+    Writes to the same record must land in order (processing, then initial diff, then
+    completed or failed), so each one waits for the previous before it starts.
+    """
+    
+    def __init__(self):
+        self._last: Optional[asyncio.Task] = None
+    
+    def submit(self, write: Awaitable, description: str) -> None:
+        """Queue a write behind the ones already submitted; failures are only logged."""
+        previous = self._last
+        
+        async def run() -> None:
+            if previous is not None:
+                await previous
+            await _await_logged(write, description)
+        
+        self._last = asyncio.create_task(run())
+    
+    async def drain(self) -> None:
+        """Wait until every submitted write has finished."""
+        if self._last is not None:
+            await self._last
+
+def _result_cache_key(owner: str, repo: str, head_sha: str, prompt: str, enable_reflection: bool) -> str:
+    """Hash the inputs that determine a request's result, for reusing earlier results.
+    
+    The repository is part of the key: forks share commits, but the pull request of an
+    earlier result is opened against the repository it was made for.
+    """
+    key = f"{owner}/{repo}|{head_sha}|{prompt}|{enable_reflection}"
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+async def _as_sections(diff_content: str) -> AsyncIterator[str]:
+    """Feed an already complete diff to apply_diff_and_create_pr."""
+    yield diff_content
+
+async def generate_diff(request: DiffRequest, executor: Optional[Executor] = None) -> DiffResponse:
     """Generate a unified diff for the given repository and prompt."""
-    temp_dir = None
     github_service = GitHubService()
     diff_applier = DiffApplier()
     supabase_service = SupabaseService()
@@ -30,6 +96,10 @@ async def generate_diff(request: DiffRequest) -> DiffResponse:
     start_time = time.time()
     request_id = None
     
+    # Status updates nothing downstream reads back; they are all awaited before returning
+    db_writes = _BackgroundWrites()
+    mirror_checkout = AsyncExitStack()
+    
     try:
         # Parse repository info
         owner, repo = github_service.parse_repo_url(request.repoUrl)
@@ -42,46 +112,80 @@ async def generate_diff(request: DiffRequest) -> DiffResponse:
         )
         request_id = await supabase_service.create_request(db_request, owner, repo)
         
-        # Mark as processing
-        await supabase_service.mark_as_processing(request_id)
+        db_writes.submit(supabase_service.mark_as_processing(request_id), "mark request as processing")
         
-        # Create temporary directory for cloning
-        temp_dir = tempfile.mkdtemp()
-        logger.info(f"Created temp directory: {temp_dir}")
-        
-        # Check repository access
-        has_access = await github_service.check_repository_access(owner, repo)
-        if not has_access:
-            error_msg = f"No write access to repository {owner}/{repo}. Make sure the GitHub token has appropriate permissions."
-            await supabase_service.mark_as_failed(request_id, error_msg)
-            raise Exception(error_msg)
+        # Read from the cached mirror of the repository, updated to the tip of the default
+        # branch. It is a bare, blob-less mirror: files are read straight from git objects,
+        # and only contents that no earlier request read are downloaded.
+        # The mirror stays checked out until the request is done, since the commit also
+        # needs the modes of the files it changes
+        repo_path, commit = await mirror_checkout.enter_async_context(
+            repo_mirrors.checkout(owner, repo, request.repoUrl)
+        )
         
-        # Clone repository
-        await clone_repository(request.repoUrl, temp_dir)
+        # The same prompt against the same commit gives the same result, so reuse a
+        # completed one instead of calling the LLM again
+        prompt_hash = _result_cache_key(owner, repo, commit, request.prompt, request.enableReflection)
+        db_writes.submit(
+            supabase_service.update_request(
+                request_id, DiffRequestUpdate(head_sha=commit, prompt_hash=prompt_hash)
+            ),
+            "store result cache key"
+        )
         
-        # Get repository structure
-        repo_structure = get_repo_structure(temp_dir)
+        cached = await supabase_service.find_completed(prompt_hash, owner, repo)
+        if cached is not None:
+            logger.info(f"Reusing the result of request {cached.id} for request {request_id}")
+            processing_time = time.time() - start_time
+            
+            db_writes.submit(supabase_service.mark_as_completed(
+                request_id=request_id,
+                final_diff=cached.final_diff,
+                reflection_applied=cached.reflection_applied,
+                original_diff=cached.original_diff,
+                branch_name=cached.branch_name,
+                pull_request_url=cached.pull_request_url,
+                processing_time=processing_time
+            ), "mark request as completed")
+            
+            return DiffResponse(
+                diff=cached.final_diff,
+                reflection_applied=cached.reflection_applied,
+                original_diff=cached.original_diff,
+                pull_request_url=cached.pull_request_url,
+                branch_name=cached.branch_name
+            )
         
-        # Read key file contents
-        key_files = repo_structure.split('\n')[:20]  # Limit to first 20 files
-        file_contents = read_file_contents(temp_dir, key_files)
+        # Get the key files, priority files first; the listing stops after 20
+        async with aclosing(get_repo_structure(repo_path, max_files=20, rev=commit)) as paths:
+            key_files = [path async for path in paths]
+        repo_structure = '\n'.join(sorted(key_files))
         
-        # Generate initial diff
-        logger.info("Generating initial diff...")
-        initial_diff = await generate_initial_diff(repo_structure, file_contents, request.prompt)
+        # Read key file contents, fetching them from GitHub in one batch first
+        await prefetch_blobs(repo_path, key_files, rev=commit)
+        file_contents = await read_file_contents(repo_path, key_files, rev=commit)
         
-        # Store initial diff in database
-        await supabase_service.update_request(request_id, DiffRequestUpdate(initial_diff=initial_diff))
+        branch_name = f"ai-changes-{uuid.uuid4().hex[:8]}"
         
         # Initialize response values
-        final_diff = initial_diff
         reflection_applied = False
         original_diff = None
         
         # Run reflection only if enabled
         if request.enableReflection:
+            # Reflection needs the whole diff up front, so generate it in one go
+            logger.info("Generating initial diff...")
+            initial_diff = await generate_initial_diff(repo_structure, file_contents, request.prompt)
+            
+            # Store initial diff in database in the background
+            db_writes.submit(
+                supabase_service.update_request(request_id, DiffRequestUpdate(initial_diff=initial_diff)),
+                "store initial diff"
+            )
+            
+            final_diff = initial_diff
             logger.info("Reflection enabled - running reflection...")
-            reflection = await reflect_on_diff(initial_diff, repo_structure, request.prompt)
+            reflection = await reflect_on_diff(initial_diff, request.prompt)
             
             # Determine final diff
             if reflection.get("needs_changes", False):
@@ -91,20 +195,37 @@ async def generate_diff(request: DiffRequest) -> DiffResponse:
                 logger.info("Reflection suggested improvements, using improved diff")
             else:
                 logger.info("Reflection approved original diff")
+            
+            # Create branch and apply changes
+            pull_request_url, final_diff = await apply_diff_and_create_pr(
+                github_service, diff_applier, owner, repo, repo_path, commit, branch_name,
+                _as_sections(final_diff), request.prompt, executor
+            )
         else:
-            logger.info("Reflection disabled - using initial diff")
-        
-        # Create branch and apply changes
-        branch_name = f"ai-changes-{uuid.uuid4().hex[:8]}"
-        pull_request_url = await apply_diff_and_create_pr(
-            github_service, diff_applier, owner, repo, branch_name, final_diff, request.prompt
-        )
+            # Stream the initial diff straight into the branch, so earlier files are
+            # committed while later ones are still being generated
+            logger.info("Reflection disabled - streaming initial diff...")
+            
+            def store_initial_diff(initial_diff: str) -> None:
+                # Store initial diff in database in the background, as soon as generation
+                # is done and even if applying it fails
+                db_writes.submit(
+                    supabase_service.update_request(request_id, DiffRequestUpdate(initial_diff=initial_diff)),
+                    "store initial diff"
+                )
+            
+            pull_request_url, initial_diff = await apply_diff_and_create_pr(
+                github_service, diff_applier, owner, repo, repo_path, commit, branch_name,
+                stream_initial_diff(repo_structure, file_contents, request.prompt),
+                request.prompt, executor, on_diff=store_initial_diff
+            )
+            final_diff = initial_diff
         
         # Calculate processing time
         processing_time = time.time() - start_time
         
         # Mark as completed in database
-        await supabase_service.mark_as_completed(
+        db_writes.submit(supabase_service.mark_as_completed(
             request_id=request_id,
             final_diff=final_diff,
             reflection_applied=reflection_applied,
@@ -112,7 +233,7 @@ async def generate_diff(request: DiffRequest) -> DiffResponse:
             branch_name=branch_name,
             pull_request_url=pull_request_url,
             processing_time=processing_time
-        )
+        ), "mark request as completed")
         
         logger.info(f"Successfully processed request {request_id} in {processing_time:.2f}s")
         
@@ -127,105 +248,161 @@ async def generate_diff(request: DiffRequest) -> DiffResponse:
     except Exception as e:
         logger.error(f"Error processing request: {e}")
         
-        # Mark as failed in database if we have a request_id
+        # Mark as failed in database if we have a request_id; queued behind any pending
+        # write so it cannot be overwritten by an earlier status
         if request_id:
-            await supabase_service.mark_as_failed(
+            db_writes.submit(supabase_service.mark_as_failed(
                 request_id=request_id,
                 error_message=str(e),
                 error_details=f"Error occurred after {time.time() - start_time:.2f}s"
-            )
+            ), "mark request as failed")
         
         raise e
         
     finally:
-        # Clean up temporary directory
-        if temp_dir and os.path.exists(temp_dir):
-            shutil.rmtree(temp_dir)
-            logger.info(f"Cleaned up temp directory: {temp_dir}")
+        try:
+            await mirror_checkout.aclose()
+        finally:
+            # Only respond once the database reflects the outcome, even if releasing the
+            # mirror failed
+            await db_writes.drain()
 
 async def apply_diff_and_create_pr(github_service: GitHubService, diff_applier: DiffApplier, 
-                                  owner: str, repo: str, branch_name: str, 
-                                  diff_content: str, prompt: str) -> str:
-    """Apply the diff to a new branch and create a pull request."""
+                                  owner: str, repo: str, repo_path: str, rev: str,
+                                  branch_name: str,
+                                  diff_sections: AsyncIterator[str], prompt: str,
+                                  executor: Optional[Executor] = None,
+                                  on_diff: Optional[Callable[[str], None]] = None) -> Tuple[str, str]:
+    """Apply the diff to a new branch and create a pull request.
+    
+    diff_sections yields the diff in pieces (see stream_initial_diff); the files in each piece
+    are uploaded as soon as it arrives. All changes land in a single commit, made with the
+    Git Data API, that the new branch is created at; changed files keep their mode in the
+    mirror at repo_path and rev, which the diff was generated against. on_diff is called with
+    the full diff as soon as diff_sections is exhausted, even if applying it fails afterwards.
+    Returns the pull request URL and the full diff.
+    """
+    
+    async def get_base() -> Tuple[str, str, str]:
+        # Get default branch
+        default_branch = await github_service.get_default_branch(owner, repo)
+        
+        # Get latest commit SHA, and the tree the new commit is based on
+        base_sha = await github_service.get_branch_sha(owner, repo, default_branch)
+        base_tree = await github_service.get_commit_tree_sha(owner, repo, base_sha)
+        return default_branch, base_sha, base_tree
     
-    # Get default branch
-    default_branch = await github_service.get_default_branch(owner, repo)
+    # Used as both the commit message and the pull request title
+    pr_title = f"AI-generated changes: {prompt[:50]}..."
+    
+    # Shared by every file so uploads stay under GitHub's secondary rate limits
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_WRITES)
     
-    # Get latest commit SHA
-    base_sha = await github_service.get_branch_sha(owner, repo, default_branch)
+    async def upload_file(file_path: str, new_content: str) -> Tuple[str, str]:
+        async with semaphore:
+            logger.info(f"Uploading file: {file_path}")
+            return file_path, await github_service.create_blob(owner, repo, new_content)
     
-    # Create new branch
-    await github_service.create_branch(owner, repo, branch_name, base_sha)
+    # Look up the base commit while the diff is still being generated
+    base_task = asyncio.create_task(get_base())
+    upload_tasks: Dict[str, asyncio.Task] = {}
+    superseded_tasks: List[asyncio.Task] = []
+    diff_parts: List[str] = []
+    file_changes: Dict[str, str] = {}
+    loop = asyncio.get_running_loop()
     
-    # Parse diff to get file changes
-    file_changes = diff_applier.extract_file_changes_from_diff(diff_content)
+    try:
+        async with aclosing(diff_sections) as sections:
+            async for section in sections:
+                diff_parts.append(section)
+                
+                # Parse the section to get file changes, off the event loop since this is CPU-bound
+                changes = await loop.run_in_executor(
+                    executor, diff_applier.extract_file_changes_from_diff, section
+                )
+                
+                for file_path, new_content in changes.items():
+                    # A later section for the same file replaces the earlier one
+                    if file_path in upload_tasks:
+                        logger.warning(f"Replacing earlier changes to {file_path}")
+                        upload_tasks[file_path].cancel()
+                        superseded_tasks.append(upload_tasks[file_path])
+                    file_changes[file_path] = new_content
+                    upload_tasks[file_path] = asyncio.create_task(upload_file(file_path, new_content))
+        
+        diff_content = ''.join(diff_parts).strip()
+        if on_diff is not None:
+            on_diff(diff_content)
+        
+        default_branch, base_sha, base_tree = await base_task
+        blobs = await asyncio.gather(*upload_tasks.values())
+        
+        if blobs:
+            # Commit every file at once and create the branch at that commit. Existing
+            # files keep their mode (e.g. executable), new files are regular files.
+            modes = await get_file_modes(repo_path, [file_path for file_path, _ in blobs], rev=rev)
+            tree_files = [
+                (file_path, blob_sha, modes.get(file_path, "100644")) for file_path, blob_sha in blobs
+            ]
+            tree_sha = await github_service.create_tree(owner, repo, base_tree, tree_files)
+            head_sha = await github_service.create_commit(owner, repo, pr_title, tree_sha, base_sha)
+        else:
+            head_sha = base_sha
+        
+        # Create new branch
+        await github_service.create_branch(owner, repo, branch_name, head_sha)
+    except HTTPException as e:
+        # There is no access check up front; the first lookup or write that is refused reports it
+        if e.status_code in ACCESS_ERROR_CODES:
+            raise Exception(
+                f"No write access to repository {owner}/{repo}. Make sure the GitHub token has appropriate permissions."
+            ) from e
+        raise
+    finally:
+        # Don't leave uploads running against a request that has already failed
+        base_task.cancel()
+        for task in upload_tasks.values():
+            task.cancel()
+        await asyncio.gather(base_task, *upload_tasks.values(), *superseded_tasks, return_exceptions=True)
+    
+    # Create pull request. Large diffs are left out of the description: GitHub caps its
+    # size, and the changes are on the branch anyway.
+    if len(diff_content) < MAX_PR_BODY_DIFF_CHARS:
+        diff_block = f"""**Generated Diff:**
+```diff
+{diff_content}
+```"""
+    elif file_changes:
+        diff_block = "_Diff omitted; see branch._"
+    else:
+        diff_block = "_Diff omitted; it is too large for the pull request description._"
     
     if not file_changes:
         logger.warning("No file changes found in diff")
         # Still create PR with just the diff as description
-        pr_title = f"AI-generated changes: {prompt[:50]}..."
         pr_body = f"""This pull request was automatically generated based on the prompt:
 
 **Prompt:** {prompt}
 
-**Generated Diff:**
-```diff
-{diff_content}
-```
+{diff_block}
 
 Note: The diff could not be automatically applied. Please review and apply changes manually.
 """
-        
-        return await github_service.create_pull_request(
-            owner, repo, branch_name, default_branch, pr_title, pr_body
-        )
-    
-    # Apply changes to each file
-    commit_message = f"AI-generated changes: {prompt[:50]}..."
-    
-    for file_path, new_content in file_changes.items():
-        try:
-            # Get existing file content and SHA
-            existing_content, file_sha = await github_service.get_file_content(
-                owner, repo, file_path, default_branch
-            )
-            
-            # If it's a new file, file_sha will be empty
-            if not file_sha and not existing_content:
-                logger.info(f"Creating new file: {file_path}")
-                await github_service.update_file(
-                    owner, repo, file_path, new_content, branch_name, commit_message
-                )
-            else:
-                # Update existing file
-                logger.info(f"Updating existing file: {file_path}")
-                # For existing files, we might need to apply the diff more carefully
-                # For now, we'll use the new content directly
-                await github_service.update_file(
-                    owner, repo, file_path, new_content, branch_name, commit_message, file_sha
-                )
-                
-        except Exception as e:
-            logger.error(f"Failed to update file {file_path}: {e}")
-            continue
-    
-    # Create pull request
-    pr_title = f"AI-generated changes: {prompt[:50]}..."
-    pr_body = f"""This pull request was automatically generated based on the prompt:
+    else:
+        file_list = "\n".join(f"- {file_path}" for file_path in file_changes)
+        pr_body = f"""This pull request was automatically generated based on the prompt:
 
 **Prompt:** {prompt}
 
 **Changes made:**
-{chr(10).join(f"- {file_path}" for file_path in file_changes.keys())}
+{file_list}
 
-**Generated Diff:**
-```diff
-{diff_content}
-```
+{diff_block}
 
 Please review the changes carefully before merging.
 """
     
-    return await github_service.create_pull_request(
+    pr_url = await github_service.create_pull_request(
         owner, repo, branch_name, default_branch, pr_title, pr_body
-    )
\ No newline at end of file
+    )
+    return pr_url, diff_content
\ No newline at end of file
@@ -4,134 +4,385 @@ GitHub API integration for creating branches and pull requests.
 
 import os
 import re
+import time
+import asyncio
+import itertools
 import logging
-from typing import Optional, Tuple
+from base64 import b64decode, b64encode
+from typing import List, Optional, Tuple
 from urllib.parse import urlparse
 import httpx
+import orjson
 from fastapi import HTTPException
+from ttl_cache import TTLCache
 
 logger = logging.getLogger(__name__)
 
+# Request headers for bodies serialized with orjson instead of httpx's stdlib json encoder
+_JSON_HEADERS = {"Content-Type": "application/json"}
+
+# Repository metadata (default branch, permissions) is stable for minutes at a time
+REPO_INFO_CACHE_SIZE = 256
+REPO_INFO_TTL_SECONDS = 300
+
+# Status codes meaning the token can't access the repository; cached repository metadata
+# can no longer be trusted after one
+ACCESS_ERROR_CODES = (401, 403, 404)
+
+# Upper bound on concurrent write requests, to stay clear of GitHub's secondary rate limits
+MAX_CONCURRENT_WRITES = 8
+
+# Retries for rate-limited requests, and the backoff before the first retry when GitHub
+# does not send a Retry-After header (doubled on each further attempt)
+MAX_RATE_LIMIT_RETRIES = 3
+RATE_LIMIT_BACKOFF_SECONDS = 1.0
+
+# Steady request rate allowed per token, with short bursts, to stay clear of GitHub's
+# secondary rate limits. Primary limits are tracked from the X-RateLimit-* headers.
+TOKEN_REQUESTS_PER_SECOND = 10.0
+TOKEN_BURST = 20
+
+# Longest wait for a rate-limited token before failing the request instead
+MAX_RATE_LIMIT_WAIT_SECONDS = 60.0
+
+# Supported GitHub repository URL formats (HTTPS and SSH), with an optional .git suffix.
+# Owners and repository names are limited to the characters GitHub allows in them.
+_GITHUB_URL_RE = re.compile(
+    r"^(?:https://github\.com/|git@github\.com:)([A-Za-z0-9-]+)/([A-Za-z0-9._-]+?)(?:\.git)?/?$"
+)
+
+class _TokenLimiter:
+    """Token bucket for one GitHub token, which also honours the limits GitHub reports for it."""
+    
+    def __init__(self, token: str):
+        self.token = token
+        self._allowance = float(TOKEN_BURST)
+        self._updated_at = time.monotonic()
+        self._blocked_until = 0.0  # GitHub refuses this token until then (time.monotonic())
+    
+    def ready_at(self) -> float:
+        """Earliest time.monotonic() at which a request can be sent with this token."""
+        refill = max(0.0, 1 - self._allowance) / TOKEN_REQUESTS_PER_SECOND
+        return max(self._blocked_until, self._updated_at + refill)
+    
+    async def acquire(self) -> None:
+        """Wait until a request may be sent with this token, and use up one request."""
+        while True:
+            now = time.monotonic()
+            self._allowance = min(
+                TOKEN_BURST, self._allowance + (now - self._updated_at) * TOKEN_REQUESTS_PER_SECOND
+            )
+            self._updated_at = now
+            
+            if now >= self._blocked_until and self._allowance >= 1:
+                self._allowance -= 1
+                return
+            await asyncio.sleep(self.ready_at() - now)
+    
+    def update(self, response: httpx.Response, retry_delay: Optional[float]) -> None:
+        """Record the rate limit state GitHub reported in a response to this token."""
+        now = time.monotonic()
+        reset = response.headers.get("X-RateLimit-Reset", "")
+        if response.headers.get("X-RateLimit-Remaining") == "0" and reset.isdigit():
+            # The reset time is a Unix timestamp
+            self._blocked_until = max(self._blocked_until, now + int(reset) - time.time())
+        if retry_delay is not None:
+            self._blocked_until = max(self._blocked_until, now + retry_delay)
+
+def _load_tokens() -> List[str]:
+    """Read the GitHub tokens to rotate through, from GITHUB_TOKENS or else GITHUB_TOKEN."""
+    tokens = [token.strip() for token in os.getenv("GITHUB_TOKENS", "").split(",") if token.strip()]
+    if not tokens and os.getenv("GITHUB_TOKEN"):
+        tokens = [os.getenv("GITHUB_TOKEN")]
+    return tokens
+
 class GitHubService:
+    # Shared across instances so connections to the GitHub API are reused between requests,
+    # and so every request draws on the same rate limits
+    _client: Optional[httpx.AsyncClient] = None
+    _limiters: List[_TokenLimiter] = []
+    _limiter_order: Optional[itertools.cycle] = None
+    _repo_info_cache = TTLCache(maxsize=REPO_INFO_CACHE_SIZE, ttl=REPO_INFO_TTL_SECONDS)
+    
     def __init__(self):
-        self.github_token = os.getenv("GITHUB_TOKEN")
+        tokens = _load_tokens()
         self.base_url = "https://api.github.com"
         
-        if not self.github_token:
-            raise ValueError("GITHUB_TOKEN environment variable is required")
+        if not tokens:
+            raise ValueError("GITHUB_TOKEN or GITHUB_TOKENS environment variable is required")
+        self.github_token = tokens[0]
+        
+        if not GitHubService._limiters:
+            GitHubService._limiters = [_TokenLimiter(token) for token in tokens]
+            GitHubService._limiter_order = itertools.cycle(range(len(tokens)))
+        
+        if GitHubService._client is None:
+            GitHubService._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                headers=self._get_headers(),
+                http2=True,
+                timeout=30.0,
+                limits=httpx.Limits(max_keepalive_connections=20, max_connections=40)
+            )
+        self._client = GitHubService._client
+    
+    @classmethod
+    async def aclose(cls) -> None:
+        """Close the shared HTTP client."""
+        if cls._client is not None:
+            await cls._client.aclose()
+            cls._client = None
     
     def _get_headers(self) -> dict:
-        """Get headers for GitHub API requests."""
+        """Get headers for GitHub API requests; the Authorization header is added per request."""
         return {
-            "Authorization": f"token {self.github_token}",
             "Accept": "application/vnd.github.v3+json",
             "User-Agent": "repo-diff-api"
         }
     
+    def _retry_delay(self, response: httpx.Response, attempt: int) -> Optional[float]:
+        """Return how long to wait before retrying a rate-limited response, or None if it wasn't."""
+        retry_after = response.headers.get("Retry-After")
+        if response.status_code == 429 or (response.status_code == 403 and (
+                retry_after is not None or response.headers.get("X-RateLimit-Remaining") == "0")):
+            if retry_after is not None and retry_after.isdigit():
+                return float(retry_after)
+            return RATE_LIMIT_BACKOFF_SECONDS * (2 ** attempt)
+        return None
+    
+    def _pick_limiter(self) -> _TokenLimiter:
+        """Pick the token that can send soonest, taking turns between tokens that are all ready."""
+        start = next(self._limiter_order)
+        candidates = self._limiters[start:] + self._limiters[:start]
+        
+        now = time.monotonic()
+        return min(candidates, key=lambda limiter: max(limiter.ready_at(), now))
+    
+    async def _request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        """Send a GitHub API request within the rate limits, retrying when rate limited anyway."""
+        headers = kwargs.pop("headers", None) or {}
+        
+        for attempt in range(MAX_RATE_LIMIT_RETRIES + 1):
+            limiter = self._pick_limiter()
+            wait = limiter.ready_at() - time.monotonic()
+            if wait > MAX_RATE_LIMIT_WAIT_SECONDS:
+                raise HTTPException(
+                    status_code=429,
+                    detail=f"GitHub rate limit exhausted, retry in {wait:.0f}s"
+                )
+            await limiter.acquire()
+            
+            response = await self._client.request(
+                method, url, headers={**headers, "Authorization": f"token {limiter.token}"}, **kwargs
+            )
+            
+            delay = self._retry_delay(response, attempt)
+            limiter.update(response, delay)
+            if delay is None:
+                return response
+            if attempt == MAX_RATE_LIMIT_RETRIES:
+                # Reported like an exhausted limit, so callers don't mistake the 403 that
+                # GitHub may use for rate limiting for a permission error
+                raise HTTPException(
+                    status_code=429,
+                    detail=f"GitHub rate limit exhausted, retry in {delay:.0f}s"
+                )
+            
+            # The next attempt waits out the delay, unless another token is free
+            logger.warning(f"GitHub rate limit hit on {method} {url}, retrying")
+        
+        return response
+    
     def parse_repo_url(self, repo_url: str) -> Tuple[str, str]:
         """Parse GitHub repository URL to extract owner and repo name."""
         # Handle various GitHub URL formats
-        patterns = [
-            r"https://github\.com/([^/]+)/([^/]+)(?:\.git)?/?$",
-            r"git@github\.com:([^/]+)/([^/]+)(?:\.git)?$"
-        ]
-        
-        for pattern in patterns:
-            match = re.match(pattern, repo_url.strip())
-            if match:
-                owner, repo = match.groups()
-                # Remove .git suffix if present
-                repo = repo.replace('.git', '')
-                return owner, repo
+        match = _GITHUB_URL_RE.match(repo_url.strip())
+        # The names end up in local paths, so "." and ".." are never valid
+        if match and match.group(2) not in ('.', '..'):
+            owner, repo = match.groups()
+            return owner, repo
         
         raise ValueError(f"Invalid GitHub repository URL: {repo_url}")
     
+    async def _get_repo_info(self, owner: str, repo: str) -> dict:
+        """Get repository metadata, served from a short-lived cache when possible."""
+        cache_key = (owner, repo)
+        repo_data = self._repo_info_cache.get(cache_key)
+        if repo_data is not None:
+            return repo_data
+        
+        url = f"/repos/{owner}/{repo}"
+        
+        response = await self._request("GET", url)
+        
+        if response.status_code != 200:
+            raise HTTPException(
+                status_code=response.status_code,
+                detail=f"Failed to get repository info: {response.text}"
+            )
+        
+        repo_data = orjson.loads(response.content)
+        self._repo_info_cache.set(cache_key, repo_data)
+        return repo_data
+    
+    def _invalidate_repo_info(self, owner: str, repo: str, status_code: int) -> None:
+        """Forget cached repository metadata after an authorization or not-found error."""
+        if status_code in ACCESS_ERROR_CODES:
+            self._repo_info_cache.pop((owner, repo))
+    
     async def get_default_branch(self, owner: str, repo: str) -> str:
         """Get the default branch of the repository."""
-        url = f"{self.base_url}/repos/{owner}/{repo}"
-        
-        async with httpx.AsyncClient() as client:
-            response = await client.get(url, headers=self._get_headers())
-            
-            if response.status_code != 200:
-                raise HTTPException(
-                    status_code=response.status_code,
-                    detail=f"Failed to get repository info: {response.text}"
-                )
-            
-            repo_data = response.json()
-            return repo_data["default_branch"]
+        repo_data = await self._get_repo_info(owner, repo)
+        return repo_data["default_branch"]
     
     async def get_branch_sha(self, owner: str, repo: str, branch: str) -> str:
         """Get the SHA of the latest commit on a branch."""
-        url = f"{self.base_url}/repos/{owner}/{repo}/git/refs/heads/{branch}"
+        url = f"/repos/{owner}/{repo}/git/refs/heads/{branch}"
         
-        async with httpx.AsyncClient() as client:
-            response = await client.get(url, headers=self._get_headers())
-            
-            if response.status_code != 200:
-                raise HTTPException(
-                    status_code=response.status_code,
-                    detail=f"Failed to get branch SHA: {response.text}"
-                )
-            
-            ref_data = response.json()
-            return ref_data["object"]["sha"]
+        response = await self._request("GET", url)
+        
+        if response.status_code != 200:
+            raise HTTPException(
+                status_code=response.status_code,
+                detail=f"Failed to get branch SHA: {response.text}"
+            )
+        
+        ref_data = orjson.loads(response.content)
+        return ref_data["object"]["sha"]
     
     async def create_branch(self, owner: str, repo: str, branch_name: str, base_sha: str) -> bool:
         """Create a new branch from the given SHA."""
-        url = f"{self.base_url}/repos/{owner}/{repo}/git/refs"
+        url = f"/repos/{owner}/{repo}/git/refs"
         
         data = {
             "ref": f"refs/heads/{branch_name}",
             "sha": base_sha
         }
         
-        async with httpx.AsyncClient() as client:
-            response = await client.post(url, json=data, headers=self._get_headers())
-            
-            if response.status_code == 201:
-                logger.info(f"Created branch: {branch_name}")
-                return True
-            elif response.status_code == 422:
-                # Branch already exists
-                logger.info(f"Branch {branch_name} already exists")
-                return True
-            else:
-                raise HTTPException(
-                    status_code=response.status_code,
-                    detail=f"Failed to create branch: {response.text}"
-                )
+        response = await self._request("POST", url, content=orjson.dumps(data), headers=_JSON_HEADERS)
+        
+        if response.status_code == 201:
+            logger.info(f"Created branch: {branch_name}")
+            return True
+        elif response.status_code == 422:
+            # Branch already exists
+            logger.info(f"Branch {branch_name} already exists")
+            return True
+        else:
+            self._invalidate_repo_info(owner, repo, response.status_code)
+            raise HTTPException(
+                status_code=response.status_code,
+                detail=f"Failed to create branch: {response.text}"
+            )
+    
+    async def get_commit_tree_sha(self, owner: str, repo: str, commit_sha: str) -> str:
+        """Get the SHA of the tree a commit points to."""
+        url = f"/repos/{owner}/{repo}/git/commits/{commit_sha}"
+        
+        response = await self._request("GET", url)
+        
+        if response.status_code != 200:
+            raise HTTPException(
+                status_code=response.status_code,
+                detail=f"Failed to get commit: {response.text}"
+            )
+        
+        commit_data = orjson.loads(response.content)
+        return commit_data["tree"]["sha"]
+    
+    async def create_blob(self, owner: str, repo: str, content: str) -> str:
+        """Upload file content as a blob and return its SHA."""
+        url = f"/repos/{owner}/{repo}/git/blobs"
+        
+        data = {
+            "content": b64encode(content.encode("utf-8")).decode("ascii"),
+            "encoding": "base64"
+        }
+        
+        response = await self._request("POST", url, content=orjson.dumps(data), headers=_JSON_HEADERS)
+        
+        if response.status_code == 201:
+            return orjson.loads(response.content)["sha"]
+        else:
+            self._invalidate_repo_info(owner, repo, response.status_code)
+            raise HTTPException(
+                status_code=response.status_code,
+                detail=f"Failed to create blob: {response.text}"
+            )
+    
+    async def create_tree(self, owner: str, repo: str, base_tree: str,
+                          files: List[Tuple[str, str, str]]) -> str:
+        """Create a tree that sets base_tree's files to the given (file_path, blob_sha, mode) entries."""
+        url = f"/repos/{owner}/{repo}/git/trees"
+        
+        data = {
+            "base_tree": base_tree,
+            "tree": [
+                {"path": file_path, "mode": mode, "type": "blob", "sha": blob_sha}
+                for file_path, blob_sha, mode in files
+            ]
+        }
+        
+        response = await self._request("POST", url, content=orjson.dumps(data), headers=_JSON_HEADERS)
+        
+        if response.status_code == 201:
+            return orjson.loads(response.content)["sha"]
+        else:
+            raise HTTPException(
+                status_code=response.status_code,
+                detail=f"Failed to create tree: {response.text}"
+            )
+    
+    async def create_commit(self, owner: str, repo: str, message: str,
+                            tree_sha: str, parent_sha: str) -> str:
+        """Create a commit of tree_sha on top of parent_sha and return its SHA."""
+        url = f"/repos/{owner}/{repo}/git/commits"
+        
+        data = {
+            "message": message,
+            "tree": tree_sha,
+            "parents": [parent_sha]
+        }
+        
+        response = await self._request("POST", url, content=orjson.dumps(data), headers=_JSON_HEADERS)
+        
+        if response.status_code == 201:
+            commit_sha = orjson.loads(response.content)["sha"]
+            logger.info(f"Created commit: {commit_sha}")
+            return commit_sha
+        else:
+            raise HTTPException(
+                status_code=response.status_code,
+                detail=f"Failed to create commit: {response.text}"
+            )
     
     async def get_file_content(self, owner: str, repo: str, file_path: str, branch: str) -> Tuple[str, str]:
         """Get file content and SHA for a specific file."""
-        url = f"{self.base_url}/repos/{owner}/{repo}/contents/{file_path}"
+        url = f"/repos/{owner}/{repo}/contents/{file_path}"
         params = {"ref": branch}
         
-        async with httpx.AsyncClient() as client:
-            response = await client.get(url, params=params, headers=self._get_headers())
-            
-            if response.status_code == 200:
-                file_data = response.json()
-                import base64
-                content = base64.b64decode(file_data["content"]).decode("utf-8")
-                return content, file_data["sha"]
-            elif response.status_code == 404:
-                # File doesn't exist
-                return "", ""
-            else:
-                raise HTTPException(
-                    status_code=response.status_code,
-                    detail=f"Failed to get file content: {response.text}"
-                )
+        response = await self._request("GET", url, params=params)
+        
+        if response.status_code == 200:
+            file_data = orjson.loads(response.content)
+            content = b64decode(file_data["content"]).decode("utf-8")
+            return content, file_data["sha"]
+        elif response.status_code == 404:
+            # File doesn't exist
+            return "", ""
+        else:
+            raise HTTPException(
+                status_code=response.status_code,
+                detail=f"Failed to get file content: {response.text}"
+            )
     
     async def update_file(self, owner: str, repo: str, file_path: str, content: str, 
                          branch: str, commit_message: str, file_sha: Optional[str] = None) -> bool:
         """Update or create a file in the repository."""
-        url = f"{self.base_url}/repos/{owner}/{repo}/contents/{file_path}"
+        url = f"/repos/{owner}/{repo}/contents/{file_path}"
         
-        import base64
-        encoded_content = base64.b64encode(content.encode("utf-8")).decode("utf-8")
+        # base64 output is pure ASCII
+        encoded_content = b64encode(content.encode("utf-8")).decode("ascii")
         
         data = {
             "message": commit_message,
@@ -142,22 +393,22 @@ class GitHubService:
         if file_sha:
             data["sha"] = file_sha
         
-        async with httpx.AsyncClient() as client:
-            response = await client.put(url, json=data, headers=self._get_headers())
-            
-            if response.status_code in [200, 201]:
-                logger.info(f"Updated file: {file_path}")
-                return True
-            else:
-                raise HTTPException(
-                    status_code=response.status_code,
-                    detail=f"Failed to update file {file_path}: {response.text}"
-                )
+        response = await self._request("PUT", url, content=orjson.dumps(data), headers=_JSON_HEADERS)
+        
+        if response.status_code in [200, 201]:
+            logger.info(f"Updated file: {file_path}")
+            return True
+        else:
+            self._invalidate_repo_info(owner, repo, response.status_code)
+            raise HTTPException(
+                status_code=response.status_code,
+                detail=f"Failed to update file {file_path}: {response.text}"
+            )
     
     async def create_pull_request(self, owner: str, repo: str, branch_name: str, 
                                  base_branch: str, title: str, body: str) -> str:
         """Create a pull request."""
-        url = f"{self.base_url}/repos/{owner}/{repo}/pulls"
+        url = f"/repos/{owner}/{repo}/pulls"
         
         data = {
             "title": title,
@@ -166,30 +417,25 @@ class GitHubService:
             "base": base_branch
         }
         
-        async with httpx.AsyncClient() as client:
-            response = await client.post(url, json=data, headers=self._get_headers())
-            
-            if response.status_code == 201:
-                pr_data = response.json()
-                logger.info(f"Created pull request: {pr_data['html_url']}")
-                return pr_data["html_url"]
-            else:
-                raise HTTPException(
-                    status_code=response.status_code,
-                    detail=f"Failed to create pull request: {response.text}"
-                )
+        response = await self._request("POST", url, content=orjson.dumps(data), headers=_JSON_HEADERS)
+        
+        if response.status_code == 201:
+            pr_data = orjson.loads(response.content)
+            logger.info(f"Created pull request: {pr_data['html_url']}")
+            return pr_data["html_url"]
+        else:
+            raise HTTPException(
+                status_code=response.status_code,
+                detail=f"Failed to create pull request: {response.text}"
+            )
     
     async def check_repository_access(self, owner: str, repo: str) -> bool:
         """Check if we have write access to the repository."""
-        url = f"{self.base_url}/repos/{owner}/{repo}"
+        try:
+            repo_data = await self._get_repo_info(owner, repo)
+        except HTTPException:
+            return False
         
-        async with httpx.AsyncClient() as client:
-            response = await client.get(url, headers=self._get_headers())
-            
-            if response.status_code == 200:
-                repo_data = response.json()
-                # Check if we have push access
-                permissions = repo_data.get("permissions", {})
-                return permissions.get("push", False)
-            else:
-                return False
\ No newline at end of file
+        # Check if we have push access
+        permissions = repo_data.get("permissions", {})
+        return permissions.get("push", False)
\ No newline at end of file
@@ -3,21 +3,97 @@ LLM util for generating and reflecting on code diffs using OpenAI GPT.
 """
 
 import os
-import json
+import re
 import logging
-from typing import Dict, Any
+from typing import Any, AsyncGenerator, Dict, List, Tuple
+import httpx
+import orjson
 from fastapi import HTTPException
 from openai import AsyncOpenAI
 
 logger = logging.getLogger(__name__)
 
+# Shared HTTP/2 connection pool, so back-to-back completions reuse a warm connection
+http_client = httpx.AsyncClient(
+    http2=True,
+    limits=httpx.Limits(max_connections=64, max_keepalive_connections=32),
+    timeout=httpx.Timeout(60.0)
+)
+
 # Initialize OpenAI client
 openai_client = AsyncOpenAI(
-    api_key=os.getenv("OPENAI_API_KEY")
+    api_key=os.getenv("OPENAI_API_KEY"),
+    http_client=http_client,
+    max_retries=2
 )
 
-async def generate_initial_diff(repo_structure: str, file_contents: str, prompt: str) -> str:
-    """Generate initial diff using OpenAI GPT."""
+async def close_openai_client() -> None:
+    """Close the connection pool shared by OpenAI calls."""
+    await http_client.aclose()
+
+# Most files, and most lines per file, shown to the model when generating a diff
+MAX_PROMPT_FILES = 10
+MAX_PROMPT_FILE_LINES = 200
+
+# Words and identifier parts compared between the prompt and each file
+_TOKEN_RE = re.compile(r"[a-z0-9]{3,}")
+
+def _tokens(text: str) -> set:
+    """Lower-cased words of at least three characters, splitting identifiers on _ . / -."""
+    return set(_TOKEN_RE.findall(text.lower()))
+
+def _split_file_blocks(repo_structure: str, file_contents: str) -> List[Tuple[str, List[str]]]:
+    """Split read_file_contents output back into (path, lines) pairs."""
+    headers = {f"=== {path} ===" for path in repo_structure.split("\n") if path}
+    blocks = []
+    
+    for line in file_contents.split("\n"):
+        if line in headers:
+            blocks.append((line[4:-4], []))
+        elif blocks:
+            blocks[-1][1].append(line)
+    
+    return blocks
+
+def select_relevant_files(repo_structure: str, prompt: str, file_contents: str,
+                          k: int = MAX_PROMPT_FILES) -> str:
+    """Keep the k files that share the most words with the prompt, each capped in length.
+    
+    Matches in a file's path count more than matches in its contents. Files keep their
+    original order, and if nothing matches the first k files are kept.
+    """
+    prompt_tokens = _tokens(prompt)
+    blocks = _split_file_blocks(repo_structure, file_contents)
+    
+    def score(block: Tuple[str, List[str]]) -> int:
+        path, lines = block
+        return (3 * len(prompt_tokens & _tokens(path))
+                + len(prompt_tokens & _tokens("\n".join(lines))))
+    
+    ranked = sorted(range(len(blocks)), key=lambda i: score(blocks[i]), reverse=True)
+    selected = sorted(ranked[:k])
+    
+    parts = []
+    for i in selected:
+        path, lines = blocks[i]
+        # Drop the blank separator read_file_contents leaves after each file
+        while lines and not lines[-1]:
+            lines = lines[:-1]
+        if len(lines) > MAX_PROMPT_FILE_LINES:
+            lines = lines[:MAX_PROMPT_FILE_LINES] + ["... <truncated>"]
+        parts.append(f"=== {path} ===\n" + "\n".join(lines) + "\n")
+    
+    return "\n".join(parts)
+
+async def stream_initial_diff(repo_structure: str, file_contents: str,
+                              prompt: str) -> AsyncGenerator[str, None]:
+    """Generate initial diff using OpenAI GPT, streaming the completion.
+    
+    Yields the diff one section at a time: a file's section is yielded as soon as the
+    next '--- ' header starts (or the completion ends), so callers can start applying
+    earlier files while later ones are still being generated. Joining the yielded
+    sections gives back the raw completion.
+    """
     system_prompt = """You are an expert software developer. You will be given a repository structure, 
 file contents, and a prompt describing changes to make. Generate a unified diff that represents 
 the changes needed to fulfill the prompt.
@@ -40,6 +116,9 @@ Example format:
      unchanged_line
 """
 
+    # Only show the files that look related to the prompt
+    file_contents = select_relevant_files(repo_structure, prompt, file_contents)
+    
     user_prompt = f"""Repository structure:
 {repo_structure}
 
@@ -51,25 +130,59 @@ Prompt: {prompt}
 Generate a unified diff to implement the requested changes:"""
 
     try:
-        response = await openai_client.chat.completions.create(
+        stream = await openai_client.chat.completions.create(
             model="gpt-4o-mini",
             messages=[
                 {"role": "system", "content": system_prompt},
                 {"role": "user", "content": user_prompt}
             ],
             max_tokens=4000,
-            temperature=0.1
+            temperature=0.1,
+            stream=True
         )
-        
-        return response.choices[0].message.content.strip()
     except Exception as e:
         logger.error(f"OpenAI API error in initial generation: {e}")
         raise HTTPException(status_code=500, detail=f"Failed to generate initial diff: {str(e)}")
+    
+    buffer = ""
+    scan_from = 0
+    try:
+        async for chunk in stream:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if not delta:
+                continue
+            
+            buffer += delta
+            
+            # Hand out every section that is followed by the start of the next file header
+            boundary = buffer.find("\n--- ", scan_from)
+            while boundary != -1:
+                yield buffer[:boundary + 1]
+                buffer = buffer[boundary + 1:]
+                boundary = buffer.find("\n--- ")
+            
+            # Only the tail can still hold the beginning of a header split across chunks
+            scan_from = max(0, len(buffer) - 4)
+    except Exception as e:
+        logger.error(f"OpenAI API error in initial generation: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to generate initial diff: {str(e)}")
+    finally:
+        await stream.response.aclose()
+    
+    if buffer:
+        yield buffer
+
+async def generate_initial_diff(repo_structure: str, file_contents: str, prompt: str) -> str:
+    """Generate initial diff using OpenAI GPT."""
+    sections = [section async for section in stream_initial_diff(repo_structure, file_contents, prompt)]
+    return "".join(sections).strip()
 
-async def reflect_on_diff(original_diff: str, repo_structure: str, prompt: str) -> Dict[str, Any]:
+async def reflect_on_diff(original_diff: str, prompt: str) -> Dict[str, Any]:
     """Reflect on the generated diff and potentially improve it."""
-    system_prompt = """You are an expert code reviewer. You will be given a unified diff, 
-the original repository structure, and the prompt that generated it. Your job is to:
+    system_prompt = """You are an expert code reviewer. You will be given a unified diff 
+and the prompt that generated it. Your job is to:
 
 1. Analyze if the diff correctly implements the requested changes
 2. Check for potential issues, bugs, or improvements
@@ -84,9 +197,6 @@ If the diff is good as-is, set needs_changes to false."""
 
     user_prompt = f"""Original prompt: {prompt}
 
-Repository structure:
-{repo_structure}
-
 Generated diff:
 {original_diff}
 
@@ -104,7 +214,7 @@ Please analyze this diff and provide your reflection:"""
             response_format={"type": "json_object"}
         )
         
-        reflection = json.loads(response.choices[0].message.content)
+        reflection = orjson.loads(response.choices[0].message.content)
         return reflection
     except Exception as e:
         logger.error(f"OpenAI API error in reflection: {e}")
@@ -1,12 +1,28 @@
+import os
 import logging
-from fastapi import FastAPI
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request
 from models import DiffRequest, DiffResponse
 from diff_generator import generate_diff
+from github_service import GitHubService
+from llm_service import close_openai_client
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Set up shared resources on startup and release them on shutdown."""
+    # Worker threads for CPU-bound diff parsing, kept off the event loop
+    app.state.executor = ThreadPoolExecutor(max_workers=min(8, os.cpu_count() or 1))
+    yield
+    app.state.executor.shutdown(wait=False)
+    await GitHubService.aclose()
+    await close_openai_client()
 
 app = FastAPI(
     title="Repo-Manager",
     description="Generate unified diffs for Github Repositories using LLM reflection",
     version="0.1.0",
+    lifespan=lifespan,
 )
 
 # Configure logging
@@ -20,9 +36,9 @@ async def health_check():
 
 
 @app.post("/command", response_model=DiffResponse)
-async def run_command(request: DiffRequest):
+async def run_command(request: DiffRequest, http_request: Request):
     """Generate a unified diff for the given repository and prompt."""
-    return await generate_diff(request)
+    return await generate_diff(request, executor=http_request.app.state.executor)
 
 
 @app.get("/")
@@ -2,30 +2,145 @@
 Repository handling utilities for cloning and analyzing GitHub repositories.
 """
 
+import io
 import os
+import shutil
+import signal
+import stat
+import asyncio
 import logging
-from pathlib import Path
-from typing import List
+from collections import OrderedDict
+from contextlib import aclosing, asynccontextmanager
+from typing import AsyncIterator, Dict, List, Optional, Tuple
 from fastapi import HTTPException
 import git
 
 logger = logging.getLogger(__name__)
 
-async def clone_repository(repo_url: str, target_dir: str) -> None:
-    """Clone a GitHub repository to the target directory."""
+# Common unimportant directories to skip when listing the repository
+SKIP_DIRS = frozenset({
+    'node_modules', '__pycache__', '.venv', 'venv', 'env',
+    '.git', 'dist', 'build', 'target'
+})
+
+# Binary files and common unimportant files
+SKIP_EXTENSIONS = ('.pyc', '.pyo', '.so', '.dylib', '.dll', '.exe',
+                   '.jpg', '.jpeg', '.png', '.gif', '.pdf', '.zip', '.tar.gz')
+
+# Bytes read at a time when skipping the unused tail of a large blob
+_DISCARD_CHUNK_SIZE = 1 << 16
+
+async def _run_git(*args: str) -> bytes:
+    """Run a git command and return its output, raising if it fails."""
+    process = await asyncio.create_subprocess_exec(
+        'git', *args,
+        stdin=asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE
+    )
+    stdout, stderr = await process.communicate()
+    
+    if process.returncode != 0:
+        raise RuntimeError(f"git {' '.join(args)} failed: {stderr.decode('utf-8', errors='ignore').strip()}")
+    
+    return stdout
+
+async def _stop_process(process: asyncio.subprocess.Process) -> None:
+    """Kill a git subprocess if it is still running, and wait for it to exit."""
+    if process.returncode is None:
+        # Signal the pid directly: Process.kill() polls the child first, which races
+        # asyncio's child watcher for the exit status
+        try:
+            os.kill(process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+    await process.wait()
+
+async def clone_repository(repo_url: str, target_dir: str, depth: Optional[int] = None,
+                           single_branch: bool = False, no_tags: bool = False,
+                           bare: bool = False, blob_filter: Optional[str] = None) -> None:
+    """Clone a GitHub repository to the target directory.
+    
+    depth limits the history fetched, single_branch fetches only the default branch and
+    no_tags skips tag refs; callers that only read the tip should set all three. bare skips
+    the working tree checkout, and blob_filter (e.g. 'blob:none') makes a partial clone
+    whose file contents are fetched on demand, see prefetch_blobs.
+    """
+    options = []
+    if depth is not None:
+        options.append(f'--depth={depth}')
+    if single_branch:
+        options.append('--single-branch')
+    if no_tags:
+        options.append('--no-tags')
+    if bare:
+        options.append('--bare')
+    if blob_filter:
+        options.append(f'--filter={blob_filter}')
+    
     try:
-        # Use git.Repo.clone_from for better error handling
-        git.Repo.clone_from(repo_url, target_dir, depth=1)
+        # Use git.Repo.clone_from for better error handling. The clone runs in a
+        # worker thread so it does not block the event loop.
+        await asyncio.to_thread(git.Repo.clone_from, repo_url, target_dir, multi_options=options)
         logger.info(f"Successfully cloned {repo_url} to {target_dir}")
     except Exception as e:
         logger.error(f"Failed to clone repository: {e}")
         raise HTTPException(status_code=400, detail=f"Failed to clone repository: {str(e)}")
 
-def get_repo_structure(repo_path: str, max_files: int = 50) -> str:
-    """Get a string representation of the repository structure."""
-    structure = []
-    repo_path_obj = Path(repo_path)
+async def _iter_tree_files(repo_path: str, recursive: bool = True,
+                           rev: str = 'HEAD') -> AsyncIterator[str]:
+    """Yield the paths of the files in rev's tree as git ls-tree lists them.
+    
+    Only tree objects are read, so this works on partial clones without fetching any blobs.
+    Closing the iterator early stops the listing.
+    """
+    args = ['git', '-C', repo_path, 'ls-tree', '-z']
+    if recursive:
+        args.append('-r')
+    args.append(rev)
+    
+    process = await asyncio.create_subprocess_exec(
+        *args,
+        stdin=asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE
+    )
+    try:
+        while True:
+            try:
+                entry = await process.stdout.readuntil(b'\0')
+            except asyncio.IncompleteReadError:
+                break
+            
+            # Each entry is "<mode> <type> <object>\t<path>"
+            meta, _, path = entry[:-1].partition(b'\t')
+            if meta.split(b' ')[1] == b'blob':  # Skip submodules
+                yield path.decode('utf-8', errors='replace')
+        
+        await process.wait()
+        if process.returncode != 0:
+            stderr = await process.stderr.read()
+            raise RuntimeError(f"git ls-tree failed: {stderr.decode('utf-8', errors='ignore').strip()}")
+    finally:
+        await _stop_process(process)
+
+def _is_relevant_path(path: str) -> bool:
+    """Check whether a repository file is worth showing to the LLM."""
+    *dirs, name = path.split('/')
+    
+    # Skip hidden, binary and common unimportant files
+    if name.startswith('.') or name.endswith(SKIP_EXTENSIONS):
+        return False
+    
+    # Skip files under hidden or common unimportant directories
+    return not any(d.startswith('.') or d in SKIP_DIRS for d in dirs)
+
+async def get_repo_structure(repo_path: str, max_files: int = 50,
+                             rev: str = 'HEAD') -> AsyncIterator[str]:
+    """Yield up to max_files relevant paths of the repository at rev, priority files first.
     
+    Paths are produced as the tree is listed, and the listing stops once max_files are out.
+    """
     # Common files to prioritize
     priority_files = [
         'README.md', 'README.txt', 'README.rst',
@@ -34,59 +149,308 @@ def get_repo_structure(repo_path: str, max_files: int = 50) -> str:
         'main.py', 'app.py', 'index.js', 'index.html'
     ]
     
-    # Get priority files first
-    found_files = []
-    for priority_file in priority_files:
-        file_path = repo_path_obj / priority_file
-        if file_path.exists() and file_path.is_file():
-            found_files.append(str(file_path.relative_to(repo_path_obj)))
-    
-    # Get other files
-    for root, dirs, files in os.walk(repo_path):
-        # Skip common unimportant directories
-        dirs[:] = [d for d in dirs if not d.startswith('.') and d not in [
-            'node_modules', '__pycache__', '.venv', 'venv', 'env',
-            '.git', 'dist', 'build', 'target'
-        ]]
+    # Get priority files first, from a single listing of the repository root
+    async with aclosing(_iter_tree_files(repo_path, recursive=False, rev=rev)) as paths:
+        top_level_files = {path async for path in paths}
+    found_files = [name for name in priority_files if name in top_level_files][:max_files]
+    for name in found_files:
+        yield name
+    
+    # Get other files, stopping the listing as soon as max_files is reached
+    seen = set(found_files)
+    count = len(found_files)
+    if count < max_files:
+        async with aclosing(_iter_tree_files(repo_path, rev=rev)) as paths:
+            async for path in paths:
+                if path in seen or not _is_relevant_path(path):
+                    continue
+                
+                seen.add(path)
+                yield path
+                count += 1
+                if count >= max_files:
+                    break
+
+async def get_file_modes(repo_path: str, file_paths: List[str], rev: str = 'HEAD') -> Dict[str, str]:
+    """Get the git modes (e.g. '100755') of the files among file_paths that exist at rev.
+    
+    Files whose mode can't be looked up are left out, so callers treat them as new files.
+    """
+    # Paths come from generated diffs; ones outside the repository make git fail outright
+    file_paths = [
+        path for path in file_paths
+        if path and not os.path.isabs(path) and '..' not in path.split('/')
+    ]
+    if not file_paths:
+        return {}
+    
+    try:
+        output = await _run_git('-C', repo_path, 'ls-tree', '-z', '--full-tree', rev, '--', *file_paths)
+    except RuntimeError as e:
+        logger.warning(f"Could not look up file modes: {e}")
+        return {}
+    
+    modes = {}
+    for entry in output.split(b'\0'):
+        # Each entry is "<mode> <type> <object>\t<path>"
+        meta, _, path = entry.partition(b'\t')
+        fields = meta.split(b' ')
+        if len(fields) == 3 and fields[1] == b'blob':
+            modes[path.decode('utf-8', errors='replace')] = fields[0].decode('ascii')
+    return modes
+
+async def prefetch_blobs(repo_path: str, file_paths: List[str], rev: str = 'HEAD') -> None:
+    """Fetch the contents of file_paths at rev into a partial clone in a single round trip.
+    
+    Without this, each missing blob is fetched lazily by its own git fetch as it is read.
+    Failures are only logged since the lazy fetch still acts as a fallback.
+    """
+    if not file_paths:
+        return
+    
+    try:
+        # Resolving paths to blob ids only needs the (already present) trees
+        object_ids = (await _run_git(
+            '-C', repo_path, 'rev-parse', *(f'{rev}:{file_path}' for file_path in file_paths)
+        )).decode('ascii').split()
         
-        root_path = Path(root)
-        for file in files:
-            if len(found_files) >= max_files:
+        await _run_git(
+            '-C', repo_path, '-c', 'fetch.negotiationAlgorithm=noop',
+            'fetch', '--no-tags', '--no-write-fetch-head', '--filter=blob:none',
+            'origin', *object_ids
+        )
+    except Exception as e:
+        logger.warning(f"Could not prefetch file contents: {e}")
+
+async def _discard(stream: asyncio.StreamReader, size: int) -> None:
+    """Read and drop size bytes from stream without holding them in memory."""
+    while size > 0:
+        chunk = await stream.read(min(size, _DISCARD_CHUNK_SIZE))
+        if not chunk:
+            raise asyncio.IncompleteReadError(b'', size)
+        size -= len(chunk)
+
+async def read_file_contents(repo_path: str, file_paths: List[str], max_chars: int = 50000,
+                             rev: str = 'HEAD') -> str:
+    """Read contents of specified files at rev up to max_chars.
+    
+    All files are streamed from a single git cat-file --batch process, so this works
+    on bare clones.
+    """
+    contents = io.StringIO()
+    if not file_paths:
+        return contents.getvalue()
+    
+    process = await asyncio.create_subprocess_exec(
+        'git', '-C', repo_path, 'cat-file', '--batch',
+        stdin=asyncio.subprocess.PIPE,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.DEVNULL
+    )
+    
+    async def send_requests() -> None:
+        process.stdin.write(''.join(f"{rev}:{file_path}\n" for file_path in file_paths).encode('utf-8'))
+        await process.stdin.drain()
+        process.stdin.close()
+    
+    # Feed requests concurrently with reading so a full stdout pipe cannot deadlock us
+    sender = asyncio.create_task(send_requests())
+    total_chars = 0
+    try:
+        for file_path in file_paths:
+            remaining = max_chars - total_chars
+            if remaining <= 0:
                 break
-                
-            file_path = root_path / file
-            rel_path = str(file_path.relative_to(repo_path))
             
-            # Skip binary files and common unimportant files
-            if (not file.startswith('.') and 
-                not file.endswith(('.pyc', '.pyo', '.so', '.dylib', '.dll', '.exe', 
-                                 '.jpg', '.jpeg', '.png', '.gif', '.pdf', '.zip', '.tar.gz')) and
-                rel_path not in found_files):
-                found_files.append(rel_path)
-    
-    return '\n'.join(sorted(found_files))
-
-def read_file_contents(repo_path: str, file_paths: List[str], max_chars: int = 50000) -> str:
-    """Read contents of specified files up to max_chars."""
-    contents = []
-    total_chars = 0
+            # Each answer is "<object> <type> <size>\n<contents>\n", or "<object> missing\n"
+            header = (await process.stdout.readline()).split()
+            if not header:
+                break
+            if len(header) < 3 or not header[-1].isdigit():
+                logger.warning(f"Could not read {file_path}: not found at {rev}")
+                continue
+            
+            size = int(header[-1])
+            if header[-2] != b'blob':
+                await _discard(process.stdout, size + 1)
+                logger.warning(f"Could not read {file_path}: not a file")
+                continue
+            
+            # Never decode more than we can keep; a UTF-8 character is at most 4 bytes
+            keep = min(size, 4 * (remaining + 1))
+            data = await process.stdout.readexactly(keep)
+            await _discard(process.stdout, size - keep + 1)
+            content = data.decode('utf-8', errors='ignore')[:remaining + 1]
+            
+            truncated = len(content) > remaining
+            if truncated:
+                content = content[:remaining] + "\n... (truncated)"
+            
+            if contents.tell():
+                contents.write('\n')
+            contents.write(f"=== {file_path} ===\n{content}\n")
+            total_chars += len(content)
+            
+            if truncated:
+                break
+    except Exception as e:
+        logger.warning(f"Could not read file contents: {e}")
+    finally:
+        await _stop_process(process)
+        sender.cancel()
+        await asyncio.gather(sender, return_exceptions=True)
+    
+    return contents.getvalue()
+
+def _dir_size(path: str) -> int:
+    """Total size in bytes of the files under path."""
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                pass
+    return total
+
+def _is_mirror_name(name: str) -> bool:
+    """Whether name can be used as a path component under the mirror cache directory."""
+    return bool(name) and name not in ('.', '..') and '/' not in name and os.sep not in name
+
+class RepoMirrorCache:
+    """Long-lived bare, blob-less mirrors of repositories, kept under a total size budget.
+    
+    Each repository is cloned once and only fetched afterwards, so repeated requests skip
+    the clone, and file contents fetched by earlier requests are already there. Mirrors are
+    stored as cache_dir/<owner>/<repo>.git; the least recently used ones are removed once
+    they take more than max_bytes in total.
+    """
     
-    for file_path in file_paths:
-        full_path = Path(repo_path) / file_path
-        if full_path.exists() and full_path.is_file():
+    def __init__(self, cache_dir: str, max_bytes: int):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._locks: Dict[Tuple[str, str], asyncio.Lock] = {}
+        self._in_use: Dict[Tuple[str, str], int] = {}
+        self._sizes: "OrderedDict[Tuple[str, str], int]" = OrderedDict()  # Least recently used first
+        self._scanned = False
+        self._prepared = False
+    
+    def _prepare(self) -> None:
+        """Create cache_dir if needed and make sure only the current user can access it.
+        
+        Mirrors are read across requests and removed on eviction, so a directory that someone
+        else owns or can write to is refused.
+        """
+        os.makedirs(self.cache_dir, mode=0o700, exist_ok=True)
+        
+        info = os.lstat(self.cache_dir)
+        if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid():
+            raise RuntimeError(f"Mirror cache directory {self.cache_dir} is not a directory owned by the current user")
+        if stat.S_IMODE(info.st_mode) & 0o077:
+            os.chmod(self.cache_dir, 0o700)
+        self._prepared = True
+    
+    def _mirror_path(self, key: Tuple[str, str]) -> str:
+        owner, repo = key
+        # Keep every mirror inside cache_dir, whatever the names contain
+        if not all(_is_mirror_name(name) for name in key):
+            raise ValueError(f"Invalid repository name for a mirror: {owner}/{repo}")
+        return os.path.join(self.cache_dir, owner, f"{repo}.git")
+    
+    @asynccontextmanager
+    async def checkout(self, owner: str, repo: str, repo_url: str) -> AsyncIterator[Tuple[str, str]]:
+        """Bring the mirror of owner/repo up to date and yield its path and tip commit.
+        
+        Read files at the yielded commit rather than HEAD, since concurrent requests may move
+        the mirror forward. The mirror is not removed while it is checked out.
+        """
+        key = (owner, repo)
+        mirror_path = self._mirror_path(key)
+        if not self._prepared:
+            self._prepare()
+        
+        self._in_use[key] = self._in_use.get(key, 0) + 1
+        try:
+            # One update at a time per repository; readers don't need the lock
+            async with self._locks.setdefault(key, asyncio.Lock()):
+                commit = await self._update(key, repo_url)
+            yield mirror_path, commit
+        finally:
+            self._in_use[key] -= 1
+            if not self._in_use[key]:
+                del self._in_use[key]
+            
+            # Cache upkeep must not fail a request that has already done its work
             try:
-                with open(full_path, 'r', encoding='utf-8', errors='ignore') as f:
-                    content = f.read()
-                    if total_chars + len(content) > max_chars:
-                        remaining = max_chars - total_chars
-                        content = content[:remaining] + "\n... (truncated)"
-                    
-                    contents.append(f"=== {file_path} ===\n{content}\n")
-                    total_chars += len(content)
-                    
-                    if total_chars >= max_chars:
-                        break
+                await self._evict(key)
             except Exception as e:
-                logger.warning(f"Could not read {file_path}: {e}")
+                logger.error(f"Failed to update the mirror cache after {owner}/{repo}: {e}")
     
-    return '\n'.join(contents)
\ No newline at end of file
+    async def _update(self, key: Tuple[str, str], repo_url: str) -> str:
+        """Fetch the remote's default branch into a mirror, cloning it if needed, and return its commit."""
+        mirror_path = self._mirror_path(key)
+        if os.path.isdir(mirror_path):
+            try:
+                await _run_git(
+                    '-C', mirror_path, 'fetch', '--depth=1', '--no-tags', '--filter=blob:none',
+                    'origin', 'HEAD'
+                )
+                return (await _run_git('-C', mirror_path, 'rev-parse', 'FETCH_HEAD')).decode('ascii').strip()
+            except RuntimeError as e:
+                # Other requests may still be reading their commit from it; only this one fails
+                if self._in_use.get(key, 0) > 1:
+                    raise
+                logger.warning(f"Could not update mirror {mirror_path}, cloning it again: {e}")
+                await asyncio.to_thread(shutil.rmtree, mirror_path, True)
+        
+        os.makedirs(os.path.dirname(mirror_path), exist_ok=True)
+        await clone_repository(
+            repo_url, mirror_path, depth=1, single_branch=True, no_tags=True,
+            bare=True, blob_filter="blob:none"
+        )
+        
+        # Automatic gc could prune commits that concurrent requests are still reading
+        await _run_git('-C', mirror_path, 'config', 'gc.auto', '0')
+        return (await _run_git('-C', mirror_path, 'rev-parse', 'HEAD')).decode('ascii').strip()
+    
+    async def _scan(self) -> None:
+        """Pick up mirrors left on disk by a previous run, as the least recently used."""
+        self._scanned = True
+        if not os.path.isdir(self.cache_dir):
+            return
+        
+        for owner in os.listdir(self.cache_dir):
+            owner_dir = os.path.join(self.cache_dir, owner)
+            if not os.path.isdir(owner_dir):
+                continue
+            for name in os.listdir(owner_dir):
+                key = (owner, name[:-len('.git')])
+                # Skip anything this cache could not have made, e.g. "<owner>/.git"
+                is_mirror = name.endswith('.git') and all(_is_mirror_name(part) for part in key)
+                if is_mirror and key not in self._sizes:
+                    self._sizes[key] = await asyncio.to_thread(_dir_size, self._mirror_path(key))
+                    self._sizes.move_to_end(key, last=False)
+    
+    async def _evict(self, key: Tuple[str, str]) -> None:
+        """Record the size of a just used mirror and remove old ones while over budget."""
+        if not self._scanned:
+            await self._scan()
+        
+        self._sizes[key] = await asyncio.to_thread(_dir_size, self._mirror_path(key))
+        self._sizes.move_to_end(key)
+        
+        total = sum(self._sizes.values())
+        for candidate in list(self._sizes):
+            if total <= self.max_bytes:
+                break
+            if candidate in self._in_use:
+                continue
+            
+            async with self._locks.setdefault(candidate, asyncio.Lock()):
+                # Checked out again while we waited for its lock
+                if candidate in self._in_use:
+                    continue
+                
+                total -= self._sizes.pop(candidate, 0)
+                await asyncio.to_thread(shutil.rmtree, self._mirror_path(candidate), True)
+                logger.info(f"Removed repository mirror {candidate[0]}/{candidate[1]} from cache")
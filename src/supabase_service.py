@@ -3,18 +3,40 @@ Supabase service for database operations.
 """
 
 import os
+import time
+import asyncio
 import logging
 import uuid
-from typing import Optional, List
-from datetime import datetime
+from typing import Optional, List, Tuple
+from datetime import datetime, timezone
 from supabase import create_client, Client
 from supabase.lib.client_options import ClientOptions
 from fastapi import HTTPException
 from database_models import DiffRequestRecord, DiffRequestCreate, DiffRequestUpdate, RequestStatus
+from ttl_cache import TTLCache
 
 logger = logging.getLogger(__name__)
 
+# Records read back by ID; writes through this process drop their entry right away
+REQUEST_CACHE_SIZE = 1024
+REQUEST_CACHE_TTL_SECONDS = 30
+
+# Usage statistics are aggregates, so a few seconds of staleness is fine
+STATS_CACHE_TTL_SECONDS = 5
+
+# Request listings, keyed by their query; writes through this process drop them all
+LIST_CACHE_SIZE = 256
+LIST_CACHE_TTL_SECONDS = 5
+
 class SupabaseService:
+    # Shared across instances, since a new service is created for every request. The
+    # client (and its connection pool) is only used from worker threads, see _execute.
+    _client: Optional[Client] = None
+    _request_cache = TTLCache(maxsize=REQUEST_CACHE_SIZE, ttl=REQUEST_CACHE_TTL_SECONDS)
+    _list_cache = TTLCache(maxsize=LIST_CACHE_SIZE, ttl=LIST_CACHE_TTL_SECONDS)
+    _stats_cache: Optional[Tuple[float, dict]] = None
+    _stats_lock = asyncio.Lock()
+    
     def __init__(self):
         self.supabase_url = os.getenv("SUPABASE_URL")
         self.supabase_key = os.getenv("SUPABASE_ANON_KEY")
@@ -22,19 +44,26 @@ class SupabaseService:
         if not self.supabase_url or not self.supabase_key:
             raise ValueError("SUPABASE_URL and SUPABASE_ANON_KEY environment variables are required")
 
-        options = ClientOptions(
-            schema='public',
-            headers={},
-            auto_refresh_token=True,
-            persist_session=True,
-        )
-        self.client: Client = create_client(self.supabase_url, self.supabase_key, options=options)
+        if SupabaseService._client is None:
+            options = ClientOptions(
+                schema='public',
+                headers={},
+                auto_refresh_token=True,
+                persist_session=True,
+            )
+            SupabaseService._client = create_client(self.supabase_url, self.supabase_key, options=options)
+        self.client: Client = SupabaseService._client
         self.table_name = "diff_requests"
     
+    async def _execute(self, query):
+        """Run a query builder's blocking execute() in a worker thread, off the event loop."""
+        return await asyncio.to_thread(query.execute)
+    
     async def create_request(self, request_data: DiffRequestCreate, repo_owner: str, repo_name: str) -> str:
         """Create a new diff request record."""
         try:
             record_id = str(uuid.uuid4())
+            now_iso = datetime.now(timezone.utc).isoformat()
             
             data = {
                 "id": record_id,
@@ -45,11 +74,12 @@ class SupabaseService:
                 "repo_owner": repo_owner,
                 "repo_name": repo_name,
                 "user_id": request_data.user_id,
-                "created_at": datetime.utcnow().isoformat(),
-                "updated_at": datetime.utcnow().isoformat(),
+                "created_at": now_iso,
+                "updated_at": now_iso,
             }
             
-            result = self.client.table(self.table_name).insert(data).execute()
+            result = await self._execute(self.client.table(self.table_name).insert(data))
+            self._list_cache.clear()
             
             if result.data:
                 logger.info(f"Created diff request record: {record_id}")
@@ -65,10 +95,19 @@ class SupabaseService:
         """Update an existing diff request record."""
         try:
             # Prepare update data, excluding None values
-            update_data = {k: v for k, v in updates.dict().items() if v is not None}
-            update_data["updated_at"] = datetime.utcnow().isoformat()
+            update_data = updates.model_dump(exclude_none=True)
+            update_data["updated_at"] = datetime.now(timezone.utc).isoformat()
             
-            result = self.client.table(self.table_name).update(update_data).eq("id", request_id).execute()
+            # Drop the cached record on both sides of the write, so a read racing with it
+            # can't put the old record back in the cache
+            self._request_cache.pop(request_id)
+            try:
+                result = await self._execute(
+                    self.client.table(self.table_name).update(update_data).eq("id", request_id)
+                )
+            finally:
+                self._request_cache.pop(request_id)
+                self._list_cache.clear()
             
             if result.data:
                 logger.info(f"Updated diff request record: {request_id}")
@@ -82,12 +121,18 @@ class SupabaseService:
             raise HTTPException(status_code=500, detail=f"Failed to update database record: {str(e)}")
     
     async def get_request(self, request_id: str) -> Optional[DiffRequestRecord]:
-        """Get a diff request record by ID."""
+        """Get a diff request record by ID, served from a short-lived cache when possible."""
+        record = self._request_cache.get(request_id)
+        if record is not None:
+            return record
+        
         try:
-            result = self.client.table(self.table_name).select("*").eq("id", request_id).execute()
+            result = await self._execute(self.client.table(self.table_name).select("*").eq("id", request_id))
             
             if result.data:
-                return DiffRequestRecord(**result.data[0])
+                record = DiffRequestRecord(**result.data[0])
+                self._request_cache.set(request_id, record)
+                return record
             else:
                 return None
                 
@@ -96,37 +141,78 @@ class SupabaseService:
             raise HTTPException(status_code=500, detail=f"Failed to get database record: {str(e)}")
     
     async def get_requests_by_repo(self, repo_owner: str, repo_name: str, limit: int = 50) -> List[DiffRequestRecord]:
-        """Get diff requests for a specific repository."""
+        """Get diff requests for a specific repository, served from a short-lived cache when possible."""
+        cache_key = ("repo", repo_owner, repo_name, limit)
+        records = self._list_cache.get(cache_key)
+        if records is not None:
+            return list(records)
+        
         try:
-            result = (self.client.table(self.table_name)
+            query = (self.client.table(self.table_name)
                      .select("*")
                      .eq("repo_owner", repo_owner)
                      .eq("repo_name", repo_name)
                      .order("created_at", desc=True)
-                     .limit(limit)
-                     .execute())
+                     .limit(limit))
+            result = await self._execute(query)
             
-            return [DiffRequestRecord(**record) for record in result.data]
+            records = [DiffRequestRecord(**record) for record in result.data]
+            self._list_cache.set(cache_key, records)
+            return list(records)
             
         except Exception as e:
             logger.error(f"Error getting requests for repo {repo_owner}/{repo_name}: {e}")
             raise HTTPException(status_code=500, detail=f"Failed to get repository records: {str(e)}")
     
     async def get_recent_requests(self, limit: int = 100) -> List[DiffRequestRecord]:
-        """Get recent diff requests."""
+        """Get recent diff requests, served from a short-lived cache when possible."""
+        cache_key = ("recent", limit)
+        records = self._list_cache.get(cache_key)
+        if records is not None:
+            return list(records)
+        
         try:
-            result = (self.client.table(self.table_name)
+            query = (self.client.table(self.table_name)
                      .select("*")
                      .order("created_at", desc=True)
-                     .limit(limit)
-                     .execute())
+                     .limit(limit))
+            result = await self._execute(query)
             
-            return [DiffRequestRecord(**record) for record in result.data]
+            records = [DiffRequestRecord(**record) for record in result.data]
+            self._list_cache.set(cache_key, records)
+            return list(records)
             
         except Exception as e:
             logger.error(f"Error getting recent requests: {e}")
             raise HTTPException(status_code=500, detail=f"Failed to get recent records: {str(e)}")
     
+    async def find_completed(self, prompt_hash: str, repo_owner: str,
+                             repo_name: str) -> Optional[DiffRequestRecord]:
+        """Get the most recent completed request for a repository with the given result cache key.
+        
+        A failed lookup is logged and treated as a miss, since the request can still be served
+        without the cached result.
+        """
+        try:
+            query = (self.client.table(self.table_name)
+                     .select("*")
+                     .eq("prompt_hash", prompt_hash)
+                     .eq("repo_owner", repo_owner)
+                     .eq("repo_name", repo_name)
+                     .eq("status", RequestStatus.COMPLETED.value)
+                     .order("created_at", desc=True)
+                     .limit(1))
+            result = await self._execute(query)
+            
+            if result.data:
+                return DiffRequestRecord(**result.data[0])
+            else:
+                return None
+            
+        except Exception as e:
+            logger.error(f"Error looking up cached result {prompt_hash}: {e}")
+            return None
+    
     async def mark_as_processing(self, request_id: str) -> bool:
         """Mark a request as processing."""
         updates = DiffRequestUpdate(status=RequestStatus.PROCESSING)
@@ -159,32 +245,28 @@ class SupabaseService:
         return await self.update_request(request_id, updates)
     
     async def get_usage_stats(self) -> dict:
-        """Get usage statistics."""
+        """Get usage statistics, cached for STATS_CACHE_TTL_SECONDS."""
+        # Concurrent callers wait for a single refresh instead of each querying the database
+        async with SupabaseService._stats_lock:
+            cached = SupabaseService._stats_cache
+            if cached is not None and time.monotonic() < cached[0]:
+                return cached[1]
+            
+            stats = await self._fetch_usage_stats()
+            SupabaseService._stats_cache = (time.monotonic() + STATS_CACHE_TTL_SECONDS, stats)
+            return stats
+    
+    async def _fetch_usage_stats(self) -> dict:
+        """Query usage statistics from the database."""
         try:
-            # Get total requests
-            total_result = self.client.table(self.table_name).select("id", count="exact").execute()
-            total_requests = total_result.count
-            
-            # Get completed requests
-            completed_result = (self.client.table(self.table_name)
-                              .select("id", count="exact")
-                              .eq("status", RequestStatus.COMPLETED.value)
-                              .execute())
-            completed_requests = completed_result.count
-            
-            # Get failed requests
-            failed_result = (self.client.table(self.table_name)
-                           .select("id", count="exact")
-                           .eq("status", RequestStatus.FAILED.value)
-                           .execute())
-            failed_requests = failed_result.count
-            
-            # Get requests with reflection
-            reflection_result = (self.client.table(self.table_name)
-                               .select("id", count="exact")
-                               .eq("reflection_applied", True)
-                               .execute())
-            reflection_requests = reflection_result.count
+            # All counts come from a single scan in the diff_request_stats() SQL function
+            result = await self._execute(self.client.rpc("diff_request_stats", {}))
+            counts = result.data[0]
+            
+            total_requests = counts["total_requests"]
+            completed_requests = counts["completed_requests"]
+            failed_requests = counts["failed_requests"]
+            reflection_requests = counts["reflection_requests"]
             
             return {
                 "total_requests": total_requests,
@@ -16,6 +16,10 @@ CREATE TABLE diff_requests (
     repo_name TEXT,
     user_id TEXT,
     
+    -- Result cache key
+    head_sha TEXT,
+    prompt_hash TEXT,
+    
     -- Processing results
     initial_diff TEXT,
     final_diff TEXT,
@@ -40,6 +44,7 @@ CREATE INDEX idx_diff_requests_status ON diff_requests(status);
 CREATE INDEX idx_diff_requests_repo ON diff_requests(repo_owner, repo_name);
 CREATE INDEX idx_diff_requests_created_at ON diff_requests(created_at DESC);
 CREATE INDEX idx_diff_requests_user_id ON diff_requests(user_id);
+CREATE INDEX idx_diff_requests_result_cache ON diff_requests(prompt_hash, created_at DESC) WHERE status = 'completed';
 
 -- Create updated_at trigger
 CREATE OR REPLACE FUNCTION update_updated_at_column()
@@ -93,4 +98,20 @@ SELECT
 FROM diff_requests
 WHERE repo_owner IS NOT NULL AND repo_name IS NOT NULL
 GROUP BY repo_owner, repo_name
-ORDER BY total_requests DESC;
\ No newline at end of file
+ORDER BY total_requests DESC;
+
+-- Usage statistics in a single scan, called as an RPC by the API
+CREATE OR REPLACE FUNCTION diff_request_stats()
+RETURNS TABLE (
+    total_requests BIGINT,
+    completed_requests BIGINT,
+    failed_requests BIGINT,
+    reflection_requests BIGINT
+) AS $$
+    SELECT 
+        COUNT(*),
+        COUNT(*) FILTER (WHERE status = 'completed'),
+        COUNT(*) FILTER (WHERE status = 'failed'),
+        COUNT(*) FILTER (WHERE reflection_applied = true)
+    FROM diff_requests;
+$$ LANGUAGE sql STABLE;
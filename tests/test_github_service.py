@@ -0,0 +1,130 @@
+"""
+Tests for the per-token rate limiting and token rotation of GitHub API calls.
+"""
+
+import os
+import sys
+import time
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+try:
+    import httpx
+    from fastapi import HTTPException
+    import github_service
+    from github_service import GitHubService, _TokenLimiter
+except ImportError as e:
+    raise unittest.SkipTest(f"Service dependencies are not installed: {e}")
+
+def _response(status_code: int, **headers: str) -> httpx.Response:
+    """Build a GitHub API response with the given status and headers."""
+    return httpx.Response(status_code, headers=headers, json={})
+
+class TokenLimiterTest(unittest.IsolatedAsyncioTestCase):
+    async def test_burst_then_steady_rate(self):
+        limiter = _TokenLimiter("token")
+        for _ in range(github_service.TOKEN_BURST):
+            await limiter.acquire()
+        
+        # The burst is used up; the next request waits for the bucket to refill
+        wait = limiter.ready_at() - time.monotonic()
+        self.assertGreater(wait, 0)
+        self.assertLessEqual(wait, 1 / github_service.TOKEN_REQUESTS_PER_SECOND)
+    
+    def test_retry_delay_blocks_the_token(self):
+        limiter = _TokenLimiter("token")
+        limiter.update(_response(429), retry_delay=30.0)
+        self.assertAlmostEqual(limiter.ready_at() - time.monotonic(), 30.0, delta=1.0)
+    
+    def test_exhausted_primary_limit_blocks_until_reset(self):
+        limiter = _TokenLimiter("token")
+        reset = str(int(time.time()) + 120)
+        limiter.update(_response(200, **{"X-RateLimit-Remaining": "0", "X-RateLimit-Reset": reset}), None)
+        self.assertAlmostEqual(limiter.ready_at() - time.monotonic(), 120, delta=2.0)
+    
+    def test_remaining_requests_do_not_block(self):
+        limiter = _TokenLimiter("token")
+        limiter.update(_response(200, **{"X-RateLimit-Remaining": "10", "X-RateLimit-Reset": "0"}), None)
+        self.assertLessEqual(limiter.ready_at(), time.monotonic())
+
+class RequestRotationTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.responses = {}
+        self.sent_with = []
+        
+        def handler(request: httpx.Request) -> httpx.Response:
+            token = request.headers["Authorization"].split()[-1]
+            self.sent_with.append(token)
+            return self.responses[token]()
+        
+        self._reset_shared_state()
+        self.addCleanup(self._reset_shared_state)
+        with mock.patch.dict(os.environ, {"GITHUB_TOKENS": "first,second"}):
+            self.service = GitHubService()
+        await self.service._client.aclose()
+        self.service._client = httpx.AsyncClient(
+            base_url=self.service.base_url, transport=httpx.MockTransport(handler)
+        )
+        self.addAsyncCleanup(self.service._client.aclose)
+    
+    def _reset_shared_state(self):
+        GitHubService._client = None
+        GitHubService._limiters = []
+        GitHubService._limiter_order = None
+    
+    async def test_tokens_take_turns(self):
+        self.responses = {"first": lambda: _response(200), "second": lambda: _response(200)}
+        for _ in range(4):
+            await self.service._request("GET", "/rate_limit")
+        self.assertEqual(sorted(self.sent_with), ["first", "first", "second", "second"])
+        self.assertNotEqual(self.sent_with[0], self.sent_with[1])
+    
+    async def test_retry_after_moves_to_the_other_token(self):
+        self.responses = {
+            "first": lambda: _response(403, **{"Retry-After": "30"}),
+            "second": lambda: _response(200),
+        }
+        # Make the first token the one tried first
+        GitHubService._limiters[1]._blocked_until = time.monotonic() + 0.01
+        
+        started = time.monotonic()
+        response = await self.service._request("GET", "/repos/o/r")
+        
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.sent_with, ["first", "second"])
+        self.assertLess(time.monotonic() - started, 5)
+        
+        # The first token stays blocked for the Retry-After period
+        self.assertIs(self.service._pick_limiter(), GitHubService._limiters[1])
+    
+    async def test_permission_errors_are_not_retried(self):
+        self.responses = {"first": lambda: _response(403), "second": lambda: _response(403)}
+        response = await self.service._request("POST", "/repos/o/r/git/blobs")
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(len(self.sent_with), 1)
+    
+    async def test_rate_limited_on_every_attempt_raises_429(self):
+        self.responses = {
+            "first": lambda: _response(403, **{"Retry-After": "0"}),
+            "second": lambda: _response(429, **{"Retry-After": "0"}),
+        }
+        with self.assertRaises(HTTPException) as raised:
+            await self.service._request("POST", "/repos/o/r/git/refs")
+        self.assertEqual(raised.exception.status_code, 429)
+        self.assertEqual(len(self.sent_with), github_service.MAX_RATE_LIMIT_RETRIES + 1)
+    
+    async def test_fails_fast_when_every_token_is_blocked_for_long(self):
+        self.responses = {"first": lambda: _response(200), "second": lambda: _response(200)}
+        later = time.monotonic() + github_service.MAX_RATE_LIMIT_WAIT_SECONDS + 60
+        for limiter in GitHubService._limiters:
+            limiter._blocked_until = later
+        
+        with self.assertRaises(HTTPException) as raised:
+            await self.service._request("GET", "/repos/o/r")
+        self.assertEqual(raised.exception.status_code, 429)
+        self.assertEqual(self.sent_with, [])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,89 @@
+"""
+Tests for splitting a streamed completion into per-file diff sections.
+"""
+
+import os
+import sys
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+os.environ.setdefault("OPENAI_API_KEY", "test-key")
+
+try:
+    from fastapi import HTTPException
+    import llm_service
+except ImportError as e:
+    raise unittest.SkipTest(f"Service dependencies are not installed: {e}")
+
+FIRST_FILE = "--- a/one.py\n+++ b/one.py\n@@ -1 +1 @@\n-old\n+new\n"
+SECOND_FILE = "--- a/two.py\n+++ b/two.py\n@@ -1 +1 @@\n-a\n+b\n"
+
+# Stands for a chunk without choices in a fake stream's deltas
+NO_CHOICES = object()
+
+class _FakeStream:
+    """Stands in for the OpenAI completion stream, yielding the given content deltas."""
+    
+    def __init__(self, deltas, error=None):
+        self.deltas = deltas
+        self.error = error
+        self.response = SimpleNamespace(aclose=mock.AsyncMock())
+    
+    async def __aiter__(self):
+        for delta in self.deltas:
+            if delta is NO_CHOICES:
+                yield SimpleNamespace(choices=[])
+            else:
+                yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=delta))])
+        if self.error is not None:
+            raise self.error
+
+class StreamInitialDiffTest(unittest.IsolatedAsyncioTestCase):
+    async def _sections(self, stream):
+        create = mock.AsyncMock(return_value=stream)
+        with mock.patch.object(llm_service.openai_client.chat.completions, "create", create):
+            return [section async for section in llm_service.stream_initial_diff("", "", "prompt")]
+    
+    async def test_completion_in_one_chunk_is_split_per_file(self):
+        sections = await self._sections(_FakeStream([FIRST_FILE + SECOND_FILE]))
+        self.assertEqual(sections, [FIRST_FILE, SECOND_FILE])
+    
+    async def test_header_split_across_chunks(self):
+        completion = FIRST_FILE + SECOND_FILE
+        header_at = len(FIRST_FILE)  # Where the second file's "--- " starts
+        for deltas in (
+            [completion[:header_at - 1], completion[header_at - 1:]],  # Before the newline
+            [completion[:header_at], completion[header_at:]],  # Between newline and header
+            [completion[:header_at + 2], completion[header_at + 2:]],  # Inside the "--- "
+            [completion[:header_at + 1], "-", "-", completion[header_at + 3:]],
+        ):
+            with self.subTest(deltas=deltas):
+                sections = await self._sections(_FakeStream(deltas))
+                self.assertEqual(sections, [FIRST_FILE, SECOND_FILE])
+    
+    async def test_character_at_a_time(self):
+        completion = FIRST_FILE + SECOND_FILE + FIRST_FILE
+        sections = await self._sections(_FakeStream(list(completion)))
+        self.assertEqual(sections, [FIRST_FILE, SECOND_FILE, FIRST_FILE])
+    
+    async def test_sections_join_back_to_the_completion(self):
+        completion = "Here is the diff:\n" + FIRST_FILE + SECOND_FILE + "Done."
+        sections = await self._sections(_FakeStream([completion[:30], completion[30:]]))
+        self.assertEqual("".join(sections), completion)
+        self.assertEqual(sections[0], "Here is the diff:\n")
+    
+    async def test_empty_deltas_and_chunks_without_choices_are_skipped(self):
+        sections = await self._sections(_FakeStream([NO_CHOICES, None, "", FIRST_FILE, NO_CHOICES]))
+        self.assertEqual(sections, [FIRST_FILE])
+    
+    async def test_stream_error_raises_and_closes_the_response(self):
+        stream = _FakeStream([FIRST_FILE, SECOND_FILE[:10]], error=RuntimeError("connection reset"))
+        with self.assertRaises(HTTPException) as raised:
+            await self._sections(stream)
+        self.assertEqual(raised.exception.status_code, 500)
+        stream.response.aclose.assert_awaited_once()
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,231 @@
+"""
+Tests for reading repositories straight from git objects and caching their mirrors,
+against real git repositories.
+"""
+
+import os
+import shutil
+import stat
+import subprocess
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+try:
+    from repo_service import RepoMirrorCache, _iter_tree_files, get_repo_structure, read_file_contents
+except ImportError as e:
+    raise unittest.SkipTest(f"Service dependencies are not installed: {e}")
+
+if shutil.which("git") is None:
+    raise unittest.SkipTest("git is not installed")
+
+def _git(repo_path: str, *args: str) -> str:
+    """Run a git command in repo_path and return its output."""
+    return subprocess.run(
+        ["git", "-C", repo_path, "-c", "user.name=test", "-c", "user.email=test@example.com", *args],
+        check=True, capture_output=True, text=True
+    ).stdout
+
+def _make_repo(files: dict) -> str:
+    """Create a git repository with one commit holding files, and return its path."""
+    repo_path = tempfile.mkdtemp()
+    _git(repo_path, "init", "-q")
+    for file_path, content in files.items():
+        full_path = os.path.join(repo_path, file_path)
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        with open(full_path, "w", encoding="utf-8") as f:
+            f.write(content)
+    _git(repo_path, "add", "-A")
+    _git(repo_path, "commit", "-q", "-m", "initial")
+    return repo_path
+
+async def _collect(paths) -> list:
+    """Drain an async iterator of paths into a list."""
+    return [path async for path in paths]
+
+class IterTreeFilesTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.repo_path = _make_repo({
+            "README.md": "readme\n",
+            "src/app.py": "print('hi')\n",
+            "odd name\twith tab.txt": "tab\n",
+            "new\nline.txt": "newline\n",
+            "ünïcode.md": "unicode\n",
+        })
+        self.addCleanup(shutil.rmtree, self.repo_path, True)
+    
+    async def test_lists_every_file_including_unusual_names(self):
+        paths = await _collect(_iter_tree_files(self.repo_path))
+        self.assertEqual(sorted(paths), sorted([
+            "README.md", "src/app.py", "odd name\twith tab.txt", "new\nline.txt", "ünïcode.md"
+        ]))
+    
+    async def test_non_recursive_lists_top_level_files_only(self):
+        paths = await _collect(_iter_tree_files(self.repo_path, recursive=False))
+        self.assertNotIn("src/app.py", paths)
+        self.assertNotIn("src", paths)
+        self.assertIn("README.md", paths)
+    
+    async def test_skips_submodules(self):
+        # A gitlink entry, as a submodule leaves in the tree
+        commit = _git(self.repo_path, "rev-parse", "HEAD").strip()
+        _git(self.repo_path, "update-index", "--add", "--cacheinfo", f"160000,{commit},vendor/lib")
+        _git(self.repo_path, "commit", "-q", "-m", "submodule")
+        
+        paths = await _collect(_iter_tree_files(self.repo_path))
+        self.assertNotIn("vendor/lib", paths)
+        self.assertIn("src/app.py", paths)
+    
+    async def test_unknown_revision_raises(self):
+        with self.assertRaises(RuntimeError):
+            await _collect(_iter_tree_files(self.repo_path, rev="0" * 40))
+
+class RepoStructureTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.repo_path = _make_repo({
+            "a.py": "a\n",
+            "main.py": "main\n",
+            "README.md": "readme\n",
+            ".hidden": "hidden\n",
+            "node_modules/dep/index.js": "dep\n",
+            "pkg/b.py": "b\n",
+        })
+        self.addCleanup(shutil.rmtree, self.repo_path, True)
+    
+    async def test_priority_files_first_and_skipped_paths_left_out(self):
+        paths = await _collect(get_repo_structure(self.repo_path))
+        self.assertEqual(paths[:2], ["README.md", "main.py"])
+        self.assertEqual(sorted(paths[2:]), ["a.py", "pkg/b.py"])
+    
+    async def test_stops_at_max_files(self):
+        paths = await _collect(get_repo_structure(self.repo_path, max_files=3))
+        self.assertEqual(len(paths), 3)
+        self.assertEqual(paths[:2], ["README.md", "main.py"])
+
+class ReadFileContentsTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.repo_path = _make_repo({
+            "first.txt": "first\n",
+            "dir/second.txt": "second\n",
+            "big.txt": "x" * 10_000,
+        })
+        self.addCleanup(shutil.rmtree, self.repo_path, True)
+    
+    async def test_reads_files_in_order(self):
+        contents = await read_file_contents(self.repo_path, ["first.txt", "dir/second.txt"])
+        self.assertEqual(contents, "=== first.txt ===\nfirst\n\n\n=== dir/second.txt ===\nsecond\n\n")
+    
+    async def test_missing_file_is_skipped(self):
+        contents = await read_file_contents(self.repo_path, ["missing.txt", "first.txt"])
+        self.assertNotIn("missing.txt", contents)
+        self.assertEqual(contents, "=== first.txt ===\nfirst\n\n")
+    
+    async def test_non_blob_is_skipped_without_breaking_later_answers(self):
+        # "dir" names a tree; its contents must be consumed so the next answer lines up
+        contents = await read_file_contents(self.repo_path, ["dir", "first.txt", "big.txt"], max_chars=20)
+        self.assertNotIn("=== dir ===", contents)
+        self.assertTrue(contents.startswith("=== first.txt ===\nfirst\n\n"))
+        self.assertIn("=== big.txt ===", contents)
+    
+    async def test_budget_cuts_a_blob_midway(self):
+        contents = await read_file_contents(
+            self.repo_path, ["first.txt", "big.txt", "dir/second.txt"], max_chars=100
+        )
+        self.assertIn("=== big.txt ===\n" + "x" * 94 + "\n... (truncated)\n", contents)
+        self.assertNotIn("second", contents)
+    
+    async def test_reads_at_the_given_revision(self):
+        first_commit = _git(self.repo_path, "rev-parse", "HEAD").strip()
+        with open(os.path.join(self.repo_path, "first.txt"), "w") as f:
+            f.write("changed\n")
+        _git(self.repo_path, "commit", "-q", "-am", "change")
+        
+        contents = await read_file_contents(self.repo_path, ["first.txt"], rev=first_commit)
+        self.assertEqual(contents, "=== first.txt ===\nfirst\n\n")
+    
+    async def test_no_files(self):
+        self.assertEqual(await read_file_contents(self.repo_path, []), "")
+
+class RepoMirrorCacheTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.source_path = _make_repo({"README.md": "readme\n", "src/app.py": "x = 1\n"})
+        self.addCleanup(shutil.rmtree, self.source_path, True)
+        self.repo_url = f"file://{self.source_path}"
+        
+        self.cache_dir = os.path.join(tempfile.mkdtemp(), "mirrors")
+        self.addCleanup(shutil.rmtree, os.path.dirname(self.cache_dir), True)
+    
+    async def test_checkout_follows_the_remote(self):
+        mirrors = RepoMirrorCache(self.cache_dir, 1 << 30)
+        async with mirrors.checkout("owner", "repo", self.repo_url) as (mirror_path, commit):
+            self.assertEqual(commit, _git(self.source_path, "rev-parse", "HEAD").strip())
+            contents = await read_file_contents(mirror_path, ["README.md"], rev=commit)
+            self.assertEqual(contents, "=== README.md ===\nreadme\n\n")
+        
+        _git(self.source_path, "commit", "-q", "--allow-empty", "-m", "next")
+        async with mirrors.checkout("owner", "repo", self.repo_url) as (_, commit):
+            self.assertEqual(commit, _git(self.source_path, "rev-parse", "HEAD").strip())
+        
+        self.assertEqual(stat.S_IMODE(os.stat(self.cache_dir).st_mode), 0o700)
+    
+    async def test_mirror_in_use_is_not_evicted(self):
+        mirrors = RepoMirrorCache(self.cache_dir, 1)
+        async with mirrors.checkout("owner", "held", self.repo_url) as (held_path, commit):
+            async with mirrors.checkout("owner", "other", self.repo_url) as (other_path, _):
+                pass
+            
+            # Over budget: the released mirror goes, the one still checked out stays readable
+            self.assertFalse(os.path.exists(other_path))
+            self.assertTrue(os.path.isdir(held_path))
+            contents = await read_file_contents(held_path, ["src/app.py"], rev=commit)
+            self.assertEqual(contents, "=== src/app.py ===\nx = 1\n\n")
+        
+        self.assertFalse(os.path.exists(held_path))
+    
+    async def test_least_recently_used_mirror_is_evicted_first(self):
+        mirrors = RepoMirrorCache(self.cache_dir, 1 << 30)
+        async with mirrors.checkout("owner", "old", self.repo_url) as (old_path, _):
+            pass
+        
+        mirrors.max_bytes = sum(mirrors._sizes.values()) + 1
+        async with mirrors.checkout("owner", "new", self.repo_url) as (new_path, _):
+            pass
+        
+        self.assertFalse(os.path.exists(old_path))
+        self.assertTrue(os.path.isdir(new_path))
+    
+    async def test_mirrors_from_an_earlier_run_are_picked_up(self):
+        async with RepoMirrorCache(self.cache_dir, 1 << 30).checkout("owner", "kept", self.repo_url):
+            pass
+        # Not a mirror this cache could have made
+        os.makedirs(os.path.join(self.cache_dir, "owner", ".git"))
+        
+        mirrors = RepoMirrorCache(self.cache_dir, 1 << 30)
+        async with mirrors.checkout("owner", "repo", self.repo_url):
+            pass
+        self.assertEqual(list(mirrors._sizes), [("owner", "kept"), ("owner", "repo")])
+    
+    async def test_failed_fetch_keeps_a_mirror_in_use(self):
+        mirrors = RepoMirrorCache(self.cache_dir, 1 << 30)
+        async with mirrors.checkout("owner", "repo", self.repo_url) as (mirror_path, commit):
+            _git(mirror_path, "remote", "set-url", "origin", "file:///nonexistent")
+            with self.assertRaises(RuntimeError):
+                async with mirrors.checkout("owner", "repo", self.repo_url):
+                    pass
+            self.assertTrue(os.path.isdir(mirror_path))
+        
+        # Once nobody reads from it, the broken mirror is cloned again
+        async with mirrors.checkout("owner", "repo", self.repo_url) as (_, recloned_commit):
+            self.assertEqual(recloned_commit, commit)
+    
+    async def test_names_outside_the_cache_are_refused(self):
+        mirrors = RepoMirrorCache(self.cache_dir, 1 << 30)
+        for owner, repo in (("..", "repo"), ("owner", ".."), ("owner", "a/b"), ("", "repo")):
+            with self.subTest(owner=owner, repo=repo), self.assertRaises(ValueError):
+                async with mirrors.checkout(owner, repo, self.repo_url):
+                    pass
+
+if __name__ == "__main__":
+    unittest.main()
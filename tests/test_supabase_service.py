@@ -0,0 +1,48 @@
+"""
+Tests for the Supabase service, run against the real client's query builders.
+"""
+
+import asyncio
+import os
+import sys
+import unittest
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+try:
+    from supabase_service import SupabaseService
+except ImportError as e:
+    raise unittest.SkipTest(f"Service dependencies are not installed: {e}")
+
+class UsageStatsTest(unittest.TestCase):
+    def setUp(self):
+        os.environ.setdefault("SUPABASE_URL", "https://example.supabase.co")
+        os.environ.setdefault("SUPABASE_ANON_KEY", "header.payload.signature")
+        SupabaseService._client = None
+        self.addCleanup(setattr, SupabaseService, "_client", None)
+        self.service = SupabaseService()
+    
+    def test_fetch_usage_stats_calls_rpc_through_client(self):
+        """The stats query is built by the real client, so its rpc signature is exercised."""
+        queries = []
+        
+        async def execute(query):
+            queries.append(query)
+            return SimpleNamespace(data=[{
+                "total_requests": 4,
+                "completed_requests": 2,
+                "failed_requests": 1,
+                "reflection_requests": 3,
+            }])
+        
+        self.service._execute = execute
+        stats = asyncio.run(self.service._fetch_usage_stats())
+        
+        self.assertEqual(len(queries), 1)
+        self.assertTrue(str(queries[0].path).endswith("/rpc/diff_request_stats"))
+        self.assertEqual(stats["pending_requests"], 1)
+        self.assertEqual(stats["success_rate"], 50)
+
+if __name__ == "__main__":
+    unittest.main()